@@ -5,6 +5,9 @@ import logging
 from ai import luck
 import random
 from trainlib import setupLogFile, play_one_game
+from options import splitOptions
+import profiler
+import sprt
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -68,7 +71,59 @@ def play_games(plist, lucky):
         winloss(players, gps, games)
 
 
-def main(name1="nn", name2="nn"):
+def loadAI(spec):
+    '''
+    An AI by module name, or name@directory to play a network with the
+    weights of another checkpoint, such as a copy of the previous model.
+    '''
+    (name, _, checkpoint) = spec.partition('@')
+    ai = importlib.import_module('ai.' + name).AI()
+    if checkpoint:
+        ai.nn.restoreFrom(checkpoint)
+    return ai
+
+
+def compare(name1, name2, options):
+    test = sprt.SPRT(float(options.get('elo0', 0)),
+                     float(options.get('elo1', 10)),
+                     float(options.get('alpha', 0.05)),
+                     float(options.get('beta', 0.05)))
+    (new, old) = (loadAI(name1), loadAI(name2))
+    logger.info("{} vs {}, H0: elo <= {}, H1: elo >= {}".format(
+        name1, name2, test.elo0, test.elo1))
+    decision = sprt.run(new, old, test,
+                        maxGames=int(options.get('max-games', 20000)),
+                        seed=options.get('seed', 0), log=logger.debug)
+    verdict = {
+        'H1': "{} is stronger".format(name1),
+        'H0': "{} is not stronger".format(name1),
+        None: "undecided",
+    }[decision]
+    print("{}: {} after {} games ({})".format(
+        decision or '-', verdict, test.games(), test.format()))
+    return decision
+
+
+def main(name1="nn", name2="nn", *args):
+    '''
+    Train two AIs against each other until interrupted, or with --sprt test
+    whether the first is stronger. With --profile[=file.json] the move
+    latency of each AI is shown at the end and written to the file.
+    '''
+    (_, options) = splitOptions(args)
+    profile = options.get('profile')
+    if profile:
+        profiler.start()
+    try:
+        if options.get('sprt'):
+            return compare(name1, name2, options)
+        train(name1, name2)
+    finally:
+        if profile:
+            profiler.finish(profile)
+
+
+def train(name1, name2):
     setupLogFile('training/' + '-'.join([name1, name2]) + '.jsonl')
     places = ['left', 'right']
     try:
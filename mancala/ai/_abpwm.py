@@ -5,6 +5,9 @@ import movedb
 
 
 def testMetaSeconds(meta, limit=None):
+    if meta[8] is not None and meta[8].is_set():
+        # asked to stop
+        return False
     timelimit = limit or meta[7]
     if timelimit is None:
         return True
@@ -15,19 +18,22 @@ def testMetaSeconds(meta, limit=None):
 
 def incMeta(meta=None, nodecount=0, movecount=0,
             pruned=0, recalled=0, stored=0, end=None,
-            timelimit=None):
+            timelimit=None, stop=None):
     """
+    stop is a threading.Event which ends the search when set.
     >>> incMeta()
-    (0, 0, 0, 0, 0, ..., None)
+    (0, 0, 0, 0, 0, ..., None, None)
     """
     if meta is None:
-        meta = (0, 0, 0, 0, 0, datetime.datetime.now(), None, timelimit)
+        meta = (0, 0, 0, 0, 0, datetime.datetime.now(), None, timelimit,
+                stop)
     return (meta[0] + nodecount, meta[1] + movecount,
             meta[2] + recalled, meta[3] + stored,
             meta[4] + pruned,
             meta[5],
             end or meta[6],
-            timelimit or meta[7])
+            timelimit or meta[7],
+            stop or meta[8])
 
 
 def serializeMeta(meta):
@@ -150,6 +156,10 @@ def alphaBeta(node, alpha=-9999, beta=9999, maximizingPlayer=True,
             if bestValue <= alpha:
                 meta = incMeta(meta, pruned=1)
                 break
+    if not testMetaSeconds(meta):
+        # out of time or stopped, so some of this subtree wasn't searched
+        # and the value isn't good for maxdepth - depth
+        return (bestValue, bestMove, meta)
     meta = incMeta(meta, stored=1)
     movedb.memorizeState(node, maxdepth - depth, bestValue, bestMove)
     return (bestValue, bestMove, meta)
@@ -181,14 +191,39 @@ def iterativeDeepening(state, movelimit, nodelimit):
     return (bestMove, ladder)
 
 
-def timedIterativeDeepening(state, timelimit):
+def timedIterativeDeepening(state, timelimit, onDepth=None, stop=None,
+                            depthlimit=None, nodelimit=None):
+    """
+    Search deeper until timelimit seconds have passed, or until depthlimit
+    is searched or nodelimit nodes are, whichever is first (the node limit is
+    checked between depths). onDepth(depth, move, stats) is called as each
+    depth is finished. Running out of time or setting the stop event ends
+    the search with the move of the last finished depth: a depth cut short
+    is dropped from the ladder (the first depth is always kept).
+    >>> state = [1, 2, 4, 4, 5, 6, 0, 12, 11, 10, 9, 8, 7, 0, 0]
+    >>> (move, ladder) = timedIterativeDeepening(state, 6, depthlimit=3)
+    >>> move, sorted(ladder)
+    (2, [1, 2, 3])
+    """
     maxdepth = 1
     bestMove = None
     ladder = {}
     meta = incMeta(timelimit=timelimit)
-    while testMetaSeconds(meta):
-        (bestMove, meta, maxdepth, ladder) = oneDepth(
+    while (testMetaSeconds(meta) and
+           (depthlimit is None or maxdepth <= depthlimit) and
+           (nodelimit is None or meta[0] < nodelimit)):
+        (move, meta, maxdepth, ladder) = oneDepth(
             state, meta, maxdepth, bestMove, ladder)
+        depth = maxdepth - 1
+        stopped = stop is not None and stop.is_set()
+        if depth > 1 and (stopped or not testMetaSeconds(meta)):
+            # out of time or stopped part way through this depth
+            del ladder[depth]
+            break
+        bestMove = move
+        if onDepth is not None:
+            onDepth(depth, *ladder[depth])
+        meta = incMeta(meta, stop=stop)
     return (bestMove, ladder)
 
 
@@ -209,8 +244,19 @@ class AI(AiBase):
             pass
 
     def move(self, state):
+        return self.search(state)
+
+    def search(self, state, timelimit=6, onDepth=None, stop=None,
+               depthlimit=None, nodelimit=None):
         # (bestMove, ladder) = iterativeDeepening(state, 50000, 500000)
-        (bestMove, ladder) = timedIterativeDeepening(state, 6)
+        (bestMove, ladder) = timedIterativeDeepening(
+            state, timelimit, onDepth, stop, depthlimit, nodelimit)
+        depth = max(ladder) if ladder else 0
+        self.lastMoveStats = {
+            'depth': depth,
+            'evaluated': ladder[depth][1]['movecount'] if ladder else 0,
+            'nodes': ladder[depth][1]['nodecount'] if ladder else 0,
+        }
         return bestMove
 
     def gameOver(self, youWin):
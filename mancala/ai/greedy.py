@@ -5,6 +5,8 @@ import game_state as s
 
 class AI(AiBase):
 
+    deterministic = True
+
     taunts = [
         "I want all the beads.",
         "I'm going to win it all.",
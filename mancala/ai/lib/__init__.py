@@ -6,6 +6,12 @@ import random
 class AiBase():
 
     taunts = ['Generic taunt!']
+    # search players may set this to a dict with 'evaluated' and 'depth'
+    # for the last move, see profiler.py
+    lastMoveStats = None
+    # True when the same state always gets the same move, so moves can be
+    # cached (see movecache.py)
+    deterministic = False
 
     def taunt(self):
         return random.choice(self.taunts)
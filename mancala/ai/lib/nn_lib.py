@@ -1,10 +1,11 @@
 import game_state as s
-# import tensorflow as tf
-import tensorflow.compat.v1 as tf 
-tf.disable_v2_behavior() 
+import importlib
 import os
 import json
 import math
+import atexit
+import shutil
+import weakref
 from timeit import default_timer as timer
 from .move_scoring import moveToVector
 import logging
@@ -13,6 +14,8 @@ from time import sleep
 
 logger = logging.getLogger(__name__)
 
+TF_IMPORT_SECONDS = None
+
 INPUT_SIZE = (s.NUM_PLAYERS * 7)
 OUTPUT_SIZE = 6
 
@@ -22,16 +25,229 @@ EPOCHS = 1
 SAVE_PATH = "./data/"
 DROPOUT_PROBABILITY = 0.10
 
+# checkpoint save policy defaults, see SavePolicy
+SAVE_EVERY_BATCHES = 10
+SAVE_EVERY_SECONDS = 300
+SAVE_RETRIES = 5
+
 # example code
 # https://github.com/shoreason/tensormnist/blob/master/examples/run_mnist_1.py
 
+# networks which have trained, so they are flushed at exit. Weak, so
+# networks which are only used to play are never kept alive by it.
+trained = weakref.WeakSet()
+
+
+@atexit.register
+def flushTrained():
+    for network in list(trained):
+        network.flush()
+
+
+def loadTF():
+    """
+    Import tensorflow.compat.v1 the first time it is needed. Importing it
+    costs seconds, and players like luck and greedy never need it.
+    """
+    global TF_IMPORT_SECONDS
+    start = timer()
+    module = importlib.import_module('tensorflow.compat.v1')
+    if TF_IMPORT_SECONDS is None:
+        module.disable_v2_behavior()
+        TF_IMPORT_SECONDS = timer() - start
+        logger.info("imported tensorflow in {} sec".format(
+            round(TF_IMPORT_SECONDS, 3)))
+    return module
+
+
+def tfLoaded():
+    return TF_IMPORT_SECONDS is not None
+
+
+class LazyTF():
+    """
+    Stands in for the tensorflow module until an attribute is used.
+    """
+
+    def __getattr__(self, name):
+        return getattr(loadTF(), name)
+
+
+tf = LazyTF()
+
 
 def trainingStream(f):
     for jsonline in f:
         yield json.loads(jsonline)
 
 
-class NetworkBase():
+def isAggregated(row):
+    """
+    Rows from dedup.py are [board, target, weight], where target is the
+    label itself. Self-play rows are [board, move, winner, ...].
+    >>> isAggregated([[0] * 15, [0.5, 1, 0, 0, 0, 0], 3])
+    True
+    >>> isAggregated([[0] * 15, 2, 1, 30, 18])
+    False
+    """
+    return isinstance(row[1], list)
+
+
+def sampleWeights(batch):
+    """
+    >>> sampleWeights([[[0] * 15, [1, 0, 0, 0, 0, 0], 3], [[0] * 15, 2, 1]])
+    [3, 1]
+    """
+    return [row[2] if isAggregated(row) else 1 for row in batch]
+
+
+def swapDirectory(newdir, target):
+    """
+    Replace directory target with newdir. Each rename is atomic, and the old
+    copy stays at target + '.old' until the new one is in place, so a reader
+    never sees a half written checkpoint.
+    """
+    old = target + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(target):
+        os.rename(target, old)
+    os.rename(newdir, target)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class SavePolicy():
+    """
+    Decide when a network should write its checkpoint: every N batches,
+    every T seconds, whenever validation accuracy improves, and at exit if
+    anything is unsaved. Set a limit to None to disable it.
+
+    >>> p = SavePolicy(every_batches=2, every_seconds=None)
+    >>> p.batchDone()
+    >>> p.shouldSave()
+    False
+    >>> p.batchDone()
+    >>> p.shouldSave()
+    True
+    >>> p.saved()
+    >>> p.shouldSave()
+    False
+    >>> p.isBest(0.5), p.isBest(0.4), p.isBest(0.6)
+    (True, False, True)
+    """
+
+    def __init__(self, every_batches=SAVE_EVERY_BATCHES,
+                 every_seconds=SAVE_EVERY_SECONDS, on_best=True,
+                 on_exit=True):
+        self.every_batches = every_batches
+        self.every_seconds = every_seconds
+        self.on_best = on_best
+        self.on_exit = on_exit
+        self.unsaved = 0
+        self.last_save = timer()
+        self.best = None
+
+    def batchDone(self):
+        self.unsaved += 1
+
+    def shouldSave(self):
+        if not self.unsaved:
+            return False
+        if self.every_batches and self.unsaved >= self.every_batches:
+            return True
+        elapsed = timer() - self.last_save
+        if self.every_seconds and elapsed >= self.every_seconds:
+            return True
+        return False
+
+    def isBest(self, accuracy):
+        if self.best is None or accuracy > self.best:
+            self.best = accuracy
+            return True
+        return False
+
+    def saved(self):
+        self.unsaved = 0
+        self.last_save = timer()
+
+
+class PolicyBase():
+    '''
+    Move choice for anything which scores the six moves of a board seen from
+    the current player's side. Subclasses provide predict(), which scores a
+    batch of input vectors. Nothing here needs tensorflow.
+    '''
+
+    def makeInputVector(self, state):
+        return state[:14]
+
+    def predict(self, inputs):
+        raise NotImplementedError
+
+    def chooseMoveRandomly(self, scores, legalMoves):
+        '''
+        Randomly choose legal move using scores as weights for the probability
+        of choosing that move.
+        '''
+        ladder = [(x, i) for i, x in enumerate(scores) if i in legalMoves]
+        total = sum([x for x, i in ladder])
+        pick = random.uniform(0, total)
+        accum = 0
+        for x, i in ladder:
+            accum += x
+            if accum >= pick:
+                return i
+        logger.debug(
+            self.name +
+            " failed to pick a move. Returning random legal move.")
+        return random.choice(legalMoves)
+
+    def chooseMoveDeterministic(self, scores, legalMoves):
+        '''
+        Picks highest scored move no matter what. NN always makes same move
+        given same input.
+        '''
+        bestmove = -1
+        bestscore = -1
+        for m in legalMoves:
+            if bestscore < scores[m]:
+                bestmove = m
+                bestscore = scores[m]
+        if bestmove < 0:
+            bestmove = legalMoves[0]
+        return bestmove
+
+    def chooseMove(self, scores, legalMoves):
+        return self.chooseMoveRandomly(scores, legalMoves)
+
+    def getMoves(self, states):
+        '''
+        Choose moves for a list of game states with one forward pass.
+        '''
+        # rotate each board for its current player
+        players = [s.getCurrentPlayer(state) for state in states]
+        boards = [s.flipBoardCurrentPlayer(state) for state in states]
+        # get output of neural network
+        y = self.predict([self.makeInputVector(b[:14]) for b in boards])
+        # y is a list containing an output vector for each board
+        # y == [[0.0108906 0.1377293 0.370027 0.2287382 0.0950692 0.1575449]]
+        moves = []
+        for board, player, row in zip(boards, players, y):
+            scores = list(row)
+            # we only want to pick from legal moves (the nn will learn these
+            # eventually, but we're helping him with this constraint)
+            legalMoves = s.getLegalMoves(board)
+            move = self.chooseMove(scores, legalMoves)
+            if len([x for x in scores if math.isnan(x)]) > 0:
+                logger.error(self.name + " returned NaN!")
+            # if we rotated the board before, rotate it back
+            moves.append(s.flipMove(move, player))
+        return moves
+
+    def getMove(self, state):
+        return self.getMoves([state])[0]
+
+
+class NetworkBase(PolicyBase):
 
     def __init__(self, name):
         self.graph = tf.Graph()
@@ -45,6 +261,7 @@ class NetworkBase():
         self.hiddenParams = []
         self.dropout_prob = DROPOUT_PROBABILITY
         self.epochs = EPOCHS
+        self.save_policy = SavePolicy()
 
     def variable(self, shape, name):
         initial = tf.truncated_normal(shape, stddev=0.1)
@@ -99,10 +316,15 @@ class NetworkBase():
                                self.b_out, name="y")
 
     def initCostFn(self):
-        # Cost
-        self.cross_entropy = tf.reduce_mean(
-            -tf.reduce_sum(self.y_ * tf.log(self.y),
-                           reduction_indices=[1]),
+        # Cost, a weighted mean so an aggregated row counts as many times as
+        # the positions it stands for (see dedup.py)
+        self.sample_weight = tf.placeholder_with_default(
+            tf.ones_like(self.y[:, 0]), shape=[None], name="sample_weight")
+        row_cost = -tf.reduce_sum(self.y_ * tf.log(self.y),
+                                  reduction_indices=[1])
+        self.cross_entropy = tf.divide(
+            tf.reduce_sum(self.sample_weight * row_cost),
+            tf.reduce_sum(self.sample_weight),
             name="cross_entropy")
 
         # Accuracy
@@ -118,18 +340,16 @@ class NetworkBase():
 
     def initSession(self):
         # use a saver to save/restore with a file
-        self.saver = tf.train.Saver(tf.trainable_variables())
+        # relative paths, because checkpoints are written to a temp dir and
+        # renamed into place
+        self.saver = tf.train.Saver(tf.trainable_variables(),
+                                    save_relative_paths=True)
 
         # don't need an interactive session here
         # https://stackoverflow.com/q/41791469/5114
         self.sess = tf.Session(graph=self.graph)
-        try:
-            logger.info("loading nn weights from {}".format(self.save_name))
-            self.saver.restore(self.sess, self.save_name)
-            loaded = True
-        except Exception as e:
-            # could not load
-            loaded = False
+        logger.info("loading nn weights from {}".format(self.save_name))
+        loaded = self.restore()
         if not loaded:
             # start from scratch
             logger.warning(
@@ -137,28 +357,143 @@ class NetworkBase():
                     self.name))
             self.sess.run(tf.global_variables_initializer())
 
-    def makeInputVector(self, state):
-        return state[:14]
+    def restore(self):
+        # the .old copy only exists for a moment while a new checkpoint is
+        # being swapped in
+        for path in [self.save_path, self.save_path + '.old']:
+            try:
+                self.saver.restore(self.sess, path + '/model')
+                return True
+            except Exception:
+                continue
+        return False
+
+    def restoreFrom(self, path):
+        '''
+        Load the weights of another checkpoint directory, such as a copy of
+        an earlier model kept for comparison. Saves then go to that directory
+        rather than over the current model.
+        '''
+        self.saver.restore(self.sess, path + '/model')
+        self.save_path = path
+        self.save_name = path + '/model'
+        self.save_policy.on_exit = False
+
+    def save(self, path=None):
+        '''
+        Write the checkpoint to path, by default save_path, which is the one
+        restore() and so the players and the API load.
+        '''
+        target = self.save_path if path is None else path
+        tmp = target + '.tmp'
+        for _ in range(SAVE_RETRIES):
+            try:
+                shutil.rmtree(tmp, ignore_errors=True)
+                os.makedirs(tmp)
+                self.saver.save(self.sess, tmp + '/model')
+                swapDirectory(tmp, target)
+                if target == self.save_path:
+                    self.save_policy.saved()
+                return True
+            except Exception as e:
+                logger.warning("{} save failed: {}".format(self.name, e))
+                sleep(.8)
+        return False
+
+    def checkpoint(self, accuracy=None):
+        '''
+        Save if the policy says so. Pass validation accuracy to also save
+        whenever it is the best seen so far, to save_path + '.best' so that
+        later periodic saves of worse weights do not overwrite it. Players
+        and the API load save_path, the latest weights; load the best ones
+        with restoreFrom.
+        '''
+        policy = self.save_policy
+        saved = False
+        if accuracy is not None and policy.on_best and \
+                policy.isBest(accuracy):
+            saved = self.save(self.save_path + '.best')
+        if policy.shouldSave():
+            saved = self.save() or saved
+        return saved
+
+    def flush(self):
+        '''
+        Save any batches trained since the last checkpoint.
+        '''
+        if self.save_policy.on_exit and self.save_policy.unsaved and \
+                hasattr(self, 'sess'):
+            logger.info("{} saving on exit".format(self.name))
+            self.save()
+
+    def validate(self, batch):
+        fd = {
+            self.x: self.encodeInputs(batch),
+            self.y_: self.encodeLabels(batch),
+            self.keep_prob: 1.0
+        }
+        return float(self.sess.run(self.accuracy, feed_dict=fd))
+
+    def predict(self, inputs):
+        fd = {self.x: inputs, self.keep_prob: 1.0}
+        return self.sess.run(self.y, fd)
+
+    def exportWeights(self):
+        '''
+        Return [(W, b), ...] as numpy arrays for each dense layer, input side
+        first. Only plain fully connected networks can be exported.
+        '''
+        params = [(W, b) for (W, b, h, d) in self.hiddenParams]
+        params.append((self.W_out, self.b_out))
+        for W, b in params:
+            if len(W.shape) != 2:
+                raise ValueError(
+                    "{} has a layer which is not dense".format(self.name))
+        return self.sess.run(params)
+
+    def getWeights(self):
+        '''
+        Values of every trainable variable, to copy into another instance of
+        the same network with setWeights.
+        '''
+        with self.graph.as_default():
+            return self.sess.run(tf.trainable_variables())
+
+    def setWeights(self, values):
+        with self.graph.as_default():
+            for var, value in zip(tf.trainable_variables(), values):
+                var.load(value, self.sess)
+
+    def encodeInputs(self, batch):
+        return [self.makeInputVector(row[0]) for row in batch]
+
+    def encodeLabels(self, batch):
+        return [row[1] if isAggregated(row) else moveToVector(*row)
+                for row in batch]
 
     def train_batch(self, batch):
+        self.trainEncoded(self.encodeInputs(batch), self.encodeLabels(batch),
+                          sampleWeights(batch))
+
+    def trainEncoded(self, inputs, labels, weights=None):
+        '''
+        Train one batch which is already encoded, so several networks can
+        share the same encoded inputs and labels.
+        '''
         start = timer()
-        dfx = [self.makeInputVector(row[0]) for row in batch] * self.epochs
-        dfy_ = [moveToVector(*row) for row in batch] * self.epochs
         fd = {
-            self.x: dfx,
-            self.y_: dfy_,
+            self.x: inputs * self.epochs,
+            self.y_: labels * self.epochs,
             self.keep_prob: 1 - self.dropout_prob
         }
+        if weights is not None:
+            fd[self.sample_weight] = weights * self.epochs
         self.train_step.run(session=self.sess, feed_dict=fd)
-        os.makedirs(self.save_path, exist_ok=True) 
-        for _ in range(5):
-            try: 
-                self.saver.save(self.sess, self.save_name)
-                break 
-            except: 
-                sleep(.8)
+        self.save_policy.batchDone()
+        trained.add(self)
+        self.checkpoint()
         end = timer()
-        count = len(batch)
+        count = len(inputs)
         diff = end - start
         rate = self.epochs * count / diff
         msg = "{} trained {} epochs of {} moves in {} sec, at rate {} m/s"
@@ -187,62 +522,3 @@ class NetworkBase():
             rows += len(head)
             head = []
         print("Trained {} moves.".format(rows))
-
-    def chooseMoveRandomly(self, scores, legalMoves):
-        '''
-        Randomly choose legal move using scores as weights for the probability
-        of choosing that move.
-        '''
-        ladder = [(x, i) for i, x in enumerate(scores) if i in legalMoves]
-        total = sum([x for x, i in ladder])
-        pick = random.uniform(0, total)
-        accum = 0
-        for x, i in ladder:
-            accum += x
-            if accum >= pick:
-                return i
-        logger.debug(
-            self.name +
-            " failed to pick a move. Returning random legal move.")
-        return random.choice(legalMoves)
-
-    def chooseMoveDeterministic(self, scores, legalMoves):
-        '''
-        Picks highest scored move no matter what. NN always makes same move
-        given same input.
-        '''
-        bestmove = -1
-        bestscore = -1
-        for m in legalMoves:
-            if bestscore < scores[m]:
-                bestmove = m
-                bestscore = scores[m]
-        if bestmove < 0:
-            bestmove = legalMoves[0]
-        return bestmove
-
-    def getMove(self, state):
-        # rotate the board for current player
-        player = s.getCurrentPlayer(state)
-        if player != 0:
-            flip = True
-            board = s.flipBoard(state)
-        else:
-            flip = False
-            board = state
-        # get output of neural network
-        fd = {self.x: [self.makeInputVector(board[:14])], self.keep_prob: 1.0}
-        y = self.sess.run(self.y, fd)
-        # y is a list containing a single output vector
-        # y == [[0.0108906 0.1377293 0.370027 0.2287382 0.0950692 0.1575449]]
-        scores = list(y[0])
-        # we only want to pick from legal moves (the nn will learn these
-        # eventually, but we're helping him with this constraint)
-        legalMoves = s.getLegalMoves(board)
-        move = self.chooseMoveRandomly(scores, legalMoves)
-        if len([x for x in scores if math.isnan(x)]) > 0:
-            logger.error(self.name + " returned NaN!")
-        # if we rotated the board before, rotate it back
-        if flip:
-            move = s.flipMove(move, player)
-        return move
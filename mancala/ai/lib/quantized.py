@@ -0,0 +1,111 @@
+import os
+import numpy as np
+from . import AiNNBase
+from .nn_lib import PolicyBase, SAVE_PATH
+
+# Quantised inference for the fully connected networks. Weights are exported
+# from a checkpoint as int8 with one scale per layer, and the forward pass
+# runs in numpy, so a quantised player never imports tensorflow.
+#
+# Activations are rounded to float16 between layers, but the matrix products
+# are done in float32: numpy has no fast float16 matmul, and rounding gives
+# the same precision loss without the slowdown.
+
+QUANTIZED_PATH = SAVE_PATH + 'quantized/'
+
+
+def quantizedFile(name):
+    return QUANTIZED_PATH + name + '.npz'
+
+
+def quantizeLayer(W):
+    """
+    Symmetric int8 quantisation with one scale for the whole layer.
+    >>> q, scale = quantizeLayer(np.array([[0.5, -1.0], [0.25, 0.0]]))
+    >>> str(q.dtype), q.tolist()
+    ('int8', [[64, -127], [32, 0]])
+    >>> bool(np.abs(q * scale - [[0.5, -1.0], [0.25, 0.0]]).max() < 0.01)
+    True
+    """
+    W = np.asarray(W, dtype=np.float32)
+    scale = float(np.abs(W).max()) / 127 or 1.0
+    q = np.clip(np.round(W / scale), -127, 127).astype(np.int8)
+    return (q, scale)
+
+
+def exportQuantized(nn, filename=None):
+    filename = filename or quantizedFile(nn.name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    arrays = {}
+    for i, (W, b) in enumerate(nn.exportWeights()):
+        q, scale = quantizeLayer(W)
+        arrays['W{}'.format(i)] = q
+        arrays['scale{}'.format(i)] = np.float32(scale)
+        arrays['b{}'.format(i)] = np.asarray(b, dtype=np.float16)
+    tmp = filename + '.tmp.npz'
+    np.savez(tmp, **arrays)
+    os.replace(tmp, filename)
+    return filename
+
+
+def softmax(z):
+    """
+    >>> softmax(np.array([[0.0, 0.0]])).tolist()
+    [[0.5, 0.5]]
+    """
+    e = np.exp(z - z.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def encoderFor(module):
+    '''
+    The input encoding of a network module, without building its graph.
+    '''
+    return module.Network.__new__(module.Network).makeInputVector
+
+
+class QuantizedNetwork(PolicyBase):
+
+    def __init__(self, name, encoder=None, filename=None,
+                 activation_dtype=np.float16):
+        self.name = name
+        self.filename = filename or quantizedFile(name)
+        self.activation_dtype = activation_dtype
+        if encoder is not None:
+            self.makeInputVector = encoder
+        with np.load(self.filename) as data:
+            count = len([k for k in data.files if k.startswith('W')])
+            self.layers = []
+            for i in range(count):
+                W = data['W{}'.format(i)].astype(np.float32)
+                W *= data['scale{}'.format(i)]
+                b = data['b{}'.format(i)].astype(np.float32)
+                self.layers.append((W, b))
+
+    def predict(self, inputs):
+        h = np.asarray(inputs, dtype=np.float32)
+        last = len(self.layers) - 1
+        for i, (W, b) in enumerate(self.layers):
+            z = h @ W + b
+            if i < last:
+                z = np.maximum(z, 0)
+            h = z.astype(self.activation_dtype).astype(np.float32)
+        return softmax(h)
+
+
+class QuantizedAI(AiNNBase):
+    '''
+    Plays like module.AI, using the quantised weights exported for it.
+    '''
+
+    def __init__(self, module):
+        super().__init__()
+        self.nn = QuantizedNetwork(module.__name__, encoderFor(module))
+        self.original = module.AI
+
+    def taunt(self):
+        return self.original.taunt(self)
+
+    def train(self, data=None, datafile=None, batch_size=None):
+        # inference only, train the original network then export again
+        pass
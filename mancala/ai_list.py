@@ -1,29 +1,97 @@
 import importlib
 import glob
 import re
+import sys
+import threading
 import logging
+from timeit import default_timer as timer
+from ai.lib import nn_lib
 logger = logging.getLogger(__name__)
 
+# guards module imports and AI construction across threads
+loadLock = threading.RLock()
+
+
+class AIEntry(dict):
+    """
+    One player in an AI list. The module is imported and the AI constructed
+    the first time entry['module'] or entry['ai'] is used, so players which
+    never play a game never load (and never import tensorflow).
+
+    >>> entry = AIEntry('luck')
+    >>> 'ai' in entry
+    False
+    >>> entry['ai'].move([4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]) < 6
+    True
+    >>> sorted(k for k in entry if k.endswith('_time'))
+    ['import_time', 'init_time']
+    """
+
+    def __init__(self, name):
+        super().__init__(name=name, wins=0)
+
+    def __missing__(self, key):
+        if key not in ('module', 'ai'):
+            raise KeyError(key)
+        with loadLock:
+            if key in self:
+                return self[key]
+            if key == 'module':
+                start = timer()
+                self['module'] = importlib.import_module('ai.' + self['name'])
+                self['import_time'] = timer() - start
+            else:
+                module = self['module']
+                hadTF = nn_lib.tfLoaded()
+                start = timer()
+                self['ai'] = module.AI()
+                self['init_time'] = timer() - start
+                # the first network built pays for importing tensorflow
+                self['imported_tf'] = nn_lib.tfLoaded() and not hadTF
+                logger.info("loaded {} in {} sec".format(
+                    self['name'], round(self['init_time'], 3)))
+            return self[key]
+
+
+def listAINames():
+    # list files in dir
+    path = './mancala/ai/'
+    files = glob.glob(path + '*.py')
+    pattern = r'.*/([^_/]+\w*)\.py'
+    matches = [re.match(pattern, x) for x in files]
+    return [m.group(1) for m in matches if m is not None]
+
 
 def makeAIList(defaultList=None):
-    aiList = []
-    if defaultList:
-        groups = defaultList
-    else:
-        # list files in dir
-        path = './mancala/ai/'
-        files = glob.glob(path + '*.py')
-        pattern = r'.*/([^_/]+\w*)\.py'
-        matches = [re.match(pattern, x) for x in files]
-        groups = [m.group(1) for m in matches if m is not None]
-    for f in groups:
-        logger.info("loading {}".format(f))
-        res = {}
-        # import each
-        res['module'] = importlib.import_module('ai.' + f)
-        # initialize
-        res['ai'] = res['module'].AI()
-        res['name'] = f
-        res['wins'] = 0
-        aiList.append(res)
-    return aiList
+    groups = defaultList or listAINames()
+    return [AIEntry(f) for f in groups]
+
+
+def coldStartReport(aiList):
+    """
+    Print how long each loaded AI took to import and construct.
+    """
+    fmt = "{:>12} {:>10} {:>10} {}"
+    print(fmt.format('ai', 'import', 'init', ''))
+    for x in aiList:
+        if 'init_time' not in x:
+            print(fmt.format(x['name'], '-', '-', 'not loaded'))
+            continue
+        note = 'includes tensorflow import ({} sec)'.format(
+            round(nn_lib.TF_IMPORT_SECONDS, 3)) if x['imported_tf'] else ''
+        print(fmt.format(x['name'], round(x['import_time'], 3),
+                         round(x['init_time'], 3), note))
+
+
+def main(*names):
+    aiList = makeAIList(list(names))
+    for x in aiList:
+        try:
+            x['ai']
+        except Exception as e:
+            logger.error("could not load {}: {}".format(x['name'], e))
+    coldStartReport(aiList)
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
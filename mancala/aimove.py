@@ -1,20 +1,565 @@
 import importlib
+import os
 import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+from timeit import default_timer as timer
+
+# The AI modules import their siblings as top level modules (game_state,
+# movedb, ...), so this directory has to be on the path. It is added once
+# here rather than around each import, which raced between threads.
+MANCALA_PATH = os.path.dirname(os.path.abspath(__file__))
+if MANCALA_PATH not in sys.path:
+    sys.path.append(MANCALA_PATH)
 
 modules = {}
-players = {}
+pools = {}
+
+# guards module imports and the pools, batchers and versions dicts across
+# threads. Held only briefly, instances are constructed under their pool's
+# own lock, so loading one AI doesn't hold up requests for the others.
+loadLock = threading.RLock()
+
+# AI names which play with their exported int8 weights instead of tensorflow,
+# e.g. MANCALA_QUANTIZED=nn1h128,nn2h80 (see mancala/quantize.py)
+quantized = set(x for x in os.environ.get(
+    'MANCALA_QUANTIZED', '').split(',') if x)
+
+
+def parsePoolSizes(text):
+    """
+    Instances per AI, from a default and/or per AI sizes.
+    >>> parsePoolSizes('2,nn1h128=4, _abpwm=1')
+    (2, {'nn1h128': 4, '_abpwm': 1})
+    >>> parsePoolSizes('')
+    (1, {})
+    """
+    default = 1
+    sizes = {}
+    for item in text.split(','):
+        item = item.strip()
+        if '=' in item:
+            (name, size) = item.split('=', 1)
+            sizes[name.strip()] = int(size)
+        elif item:
+            default = int(item)
+    return (default, sizes)
+
+
+# How many instances of each AI may play at once, e.g.
+# MANCALA_POOL_SIZE=2,nn1h128=4. A request waits up to MANCALA_POOL_TIMEOUT
+# seconds for a free instance.
+(POOL_SIZE, POOL_SIZES) = parsePoolSizes(
+    os.environ.get('MANCALA_POOL_SIZE', ''))
+POOL_TIMEOUT = float(os.environ.get('MANCALA_POOL_TIMEOUT', 10))
+
+# Requests for a network AI which arrive within MANCALA_BATCH_WAIT_MS of the
+# first share one forward pass, up to MANCALA_BATCH_MAX of them (see
+# batcher.py). Off when 0.
+BATCH_WAIT = float(os.environ.get('MANCALA_BATCH_WAIT_MS', 0)) / 1000
+BATCH_MAX = int(os.environ.get('MANCALA_BATCH_MAX', 16))
+batchers = {}
+
+# Moves of deterministic AIs (AI.deterministic) are cached, up to
+# MANCALA_CACHE_SIZE positions for MANCALA_CACHE_TTL seconds (see
+# movecache.py). Size 0 turns the cache off. Stochastic AIs listed in
+# MANCALA_CACHE_STOCHASTIC are cached too, and then always play the move they
+# chose the first time in a position.
+CACHE_SIZE = int(os.environ.get('MANCALA_CACHE_SIZE', 10000))
+CACHE_TTL = float(os.environ.get('MANCALA_CACHE_TTL', 3600))
+CACHE_STOCHASTIC = set(x for x in os.environ.get(
+    'MANCALA_CACHE_STOCHASTIC', '').split(',') if x)
+moveCache = None
+
+# Server side caps on the search budget a client asks for, see searchLimits
+MAX_SEARCH_SECS = float(os.environ.get('MANCALA_MAX_SEARCH_SECS', 6))
+MAX_SEARCH_DEPTH = int(os.environ.get('MANCALA_MAX_SEARCH_DEPTH', 12))
+MAX_SEARCH_NODES = int(os.environ.get('MANCALA_MAX_SEARCH_NODES', 1000000))
+
+# ai name -> profiler.LatencyHistogram of the seconds each move took, and of
+# the seconds constructing each instance took
+moveTimes = {}
+loadTimes = {}
+timingLock = threading.Lock()
+
+# how often to look for a new checkpoint of a loaded AI
+VERSION_CHECK_SECS = 5
+# ai name -> (checkpoint version, time it was checked)
+versions = {}
+
+
+class AIBusy(Exception):
+    pass
+
+
+def makeAI(ainame):
+    if ainame in quantized:
+        from ai.lib.quantized import QuantizedAI
+        return QuantizedAI(modules[ainame])
+    return modules[ainame].AI()
+
+
+def recordTime(times, ainame, seconds):
+    with timingLock:
+        if ainame not in times:
+            from profiler import LatencyHistogram
+            times[ainame] = LatencyHistogram()
+        times[ainame].add(seconds)
+
+
+def copyTimes(times):
+    """
+    A copy of moveTimes or loadTimes, safe to read while moves are played.
+    """
+    from profiler import LatencyHistogram
+    with timingLock:
+        copies = {}
+        for ainame, h in times.items():
+            copies[ainame] = LatencyHistogram()
+            copies[ainame].merge(h)
+        return copies
+
+
+def play(ainame, player, gamestate, **limits):
+    """
+    The player's move, searching within limits if it can, timed.
+    """
+    start = timer()
+    if limits and hasattr(player, 'search'):
+        move = player.search(gamestate, **limits)
+    else:
+        move = player.move(gamestate)
+    recordTime(moveTimes, ainame, timer() - start)
+    return move
+
+
+def forwardPass(ainame, player, gamestates):
+    """
+    A network player's moves for all of the states at once, timed.
+    """
+    start = timer()
+    moves = player.nn.getMoves(gamestates)
+    # each move took its share of the forward pass
+    share = (timer() - start) / max(1, len(gamestates))
+    for _ in gamestates:
+        recordTime(moveTimes, ainame, share)
+    return moves
+
+
+class Waiter():
+
+    def __init__(self):
+        self.player = None
+        self.ready = threading.Event()
+
+
+class AIPool():
+    '''
+    Instances of one AI, each used by one request at a time. Instances are
+    constructed when needed, up to size of them. When all are busy, requests
+    wait their turn: a released instance goes to the longest waiting.
+    Instances lent out for background work are handed back as soon as a
+    request has to wait, see spare().
+    '''
+
+    def __init__(self, ainame, size):
+        self.ainame = ainame
+        self.size = size
+        self.idle = []
+        self.waiters = deque()
+        self.created = 0
+        self.lock = threading.Lock()
+        # one instance constructed at a time
+        self.createLock = threading.Lock()
+        # stop events of the background work using spare instances
+        self.spares = set()
+
+    def create(self):
+        try:
+            with self.createLock:
+                start = timer()
+                player = makeAI(self.ainame)
+                recordTime(loadTimes, self.ainame, timer() - start)
+                return player
+        except BaseException:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def acquire(self, timeout=None, block=True):
+        '''
+        An idle instance, or a new one, or the next one released within
+        timeout seconds. Raises AIBusy if none is, or returns None straight
+        away if not block.
+        '''
+        with self.lock:
+            if self.idle and not self.waiters:
+                return self.idle.pop()
+            if self.created < self.size:
+                self.created += 1
+                waiter = None
+            elif not block:
+                return None
+            else:
+                waiter = Waiter()
+                self.waiters.append(waiter)
+                for stop in self.spares:
+                    stop.set()
+        if waiter is None:
+            return self.create()
+        if timeout is None:
+            timeout = POOL_TIMEOUT
+        if not waiter.ready.wait(timeout):
+            with self.lock:
+                if waiter.player is None:
+                    self.waiters.remove(waiter)
+                    raise AIBusy("all {} instances of {} are busy".format(
+                        self.size, self.ainame))
+        return waiter.player
+
+    def acquireAll(self):
+        '''
+        Construct the rest of the instances and take all of them, waiting
+        for busy ones. Each must be released.
+        '''
+        players = []
+        while True:
+            player = self.acquire(block=False)
+            if player is None:
+                break
+            players.append(player)
+        while len(players) < self.size:
+            waiter = Waiter()
+            with self.lock:
+                self.waiters.append(waiter)
+            waiter.ready.wait()
+            players.append(waiter.player)
+        return players
+
+    def release(self, player):
+        with self.lock:
+            if self.waiters:
+                waiter = self.waiters.popleft()
+                waiter.player = player
+                waiter.ready.set()
+            else:
+                self.idle.append(player)
+
+    @contextmanager
+    def player(self, timeout=None):
+        player = self.acquire(timeout)
+        try:
+            yield player
+        finally:
+            self.release(player)
+
+    @contextmanager
+    def spare(self, stop):
+        '''
+        An instance for background work, or None if none is idle. stop is
+        set as soon as a request has to wait for an instance, and the work
+        should then end and release it.
+        '''
+        player = self.acquire(block=False)
+        if player is None:
+            yield None
+            return
+        with self.lock:
+            self.spares.add(stop)
+        try:
+            yield player
+        finally:
+            with self.lock:
+                self.spares.discard(stop)
+            self.release(player)
+
+    def stats(self):
+        with self.lock:
+            return {"size": self.size, "created": self.created,
+                    "busy": self.created - len(self.idle),
+                    "waiting": len(self.waiters)}
+
+
+def getPool(ainame):
+    """
+    The pool for the ai, importing its module the first time.
+    """
+    pool = pools.get(ainame)
+    if pool is not None:
+        return pool
+    with loadLock:
+        if ainame not in pools:
+            if ainame not in modules:
+                modules[ainame] = importlib.import_module('ai.' + ainame)
+            pools[ainame] = AIPool(ainame, POOL_SIZES.get(ainame, POOL_SIZE))
+        return pools[ainame]
+
+
+def isSearching(ainame):
+    """
+    Does the ai search (AI.search), taking up to seconds per move?
+    """
+    getPool(ainame)
+    return ainame not in quantized and hasattr(modules[ainame].AI, 'search')
+
+
+def isNetwork(ainame):
+    from ai.lib import AiNNBase
+    return ainame in quantized or issubclass(modules[ainame].AI, AiNNBase)
+
+
+def getBatcher(ainame):
+    """
+    The batcher for a network ai when batching is on, else None.
+    """
+    try:
+        return batchers[ainame]
+    except KeyError:
+        pass
+    with loadLock:
+        if ainame not in batchers:
+            pool = getPool(ainame)
+            batchers[ainame] = None
+            if BATCH_WAIT > 0 and isNetwork(ainame):
+                from batcher import MoveBatcher
+
+                def getMoves(states):
+                    with pool.player() as player:
+                        return forwardPass(ainame, player, states)
+
+                batchers[ainame] = MoveBatcher(getMoves, BATCH_WAIT,
+                                               BATCH_MAX)
+        return batchers[ainame]
+
+
+def checkpointFile(ainame):
+    name = modules[ainame].__name__
+    if ainame in quantized:
+        from ai.lib.quantized import quantizedFile
+        return quantizedFile(name)
+    if isNetwork(ainame):
+        from ai.lib.nn_lib import SAVE_PATH
+        return SAVE_PATH + 'models/' + name + '/checkpoint'
+    return None
+
+
+def checkpointVersion(ainame):
+    filename = checkpointFile(ainame)
+    try:
+        return os.stat(filename).st_mtime_ns if filename else 0
+    except OSError:
+        return 0
+
+
+def currentVersion(ainame):
+    """
+    Version of the ai's checkpoint, looked at every VERSION_CHECK_SECS. When
+    it has changed, the ai's instances are dropped, so new ones are loaded
+    from the new checkpoint (requests already playing finish on the old).
+    """
+    now = timer()
+    getPool(ainame)
+    (version, checked) = versions.get(ainame, (None, None))
+    if version is not None and now - checked < VERSION_CHECK_SECS:
+        return version
+    with loadLock:
+        (version, checked) = versions.get(ainame, (None, None))
+        if version is not None and now - checked < VERSION_CHECK_SECS:
+            return version
+        latest = checkpointVersion(ainame)
+        if version is not None and latest != version:
+            pools.pop(ainame, None)
+            batchers.pop(ainame, None)
+        versions[ainame] = (latest, now)
+        return latest
+
+
+def cacheable(ainame):
+    if CACHE_SIZE <= 0:
+        return False
+    if ainame in CACHE_STOCHASTIC:
+        return True
+    return (ainame not in quantized and
+            getattr(modules[ainame].AI, 'deterministic', False))
+
+
+def getCache():
+    global moveCache
+    if moveCache is not None:
+        return moveCache
+    with loadLock:
+        if moveCache is None:
+            from movecache import MoveCache
+            moveCache = MoveCache(CACHE_SIZE, CACHE_TTL)
+        return moveCache
+
+
+def cacheKey(ainame, version, gamestate):
+    from movecache import packState
+    try:
+        return (ainame, version, packState(gamestate))
+    except (TypeError, ValueError):
+        # not a board, let the ai complain about it
+        return None
+
+
+def cacheKeys(ainame, gamestates):
+    version = currentVersion(ainame)
+    if not cacheable(ainame):
+        return [None] * len(gamestates)
+    return [cacheKey(ainame, version, g) for g in gamestates]
+
+
+def stats():
+    """
+    Pool and batching figures by ai name.
+    """
+    with loadLock:
+        result = {name: {"pool": pool.stats()} for name, pool in pools.items()}
+        for name, b in batchers.items():
+            if b is not None:
+                result[name]["batching"] = b.report()
+    return result
+
+
+def preload(ainame, gamestate):
+    """
+    Construct every instance of the ai and have each choose one move, so
+    the first requests for it don't pay for imports, building graphs or
+    restoring checkpoints. Returns the seconds spent on each.
+    """
+    start = timer()
+    pool = getPool(ainame)
+    players = pool.acquireAll()
+    loaded = timer()
+    try:
+        for player in players:
+            player.move(gamestate)
+    finally:
+        for player in players:
+            pool.release(player)
+    return {"load_sec": loaded - start, "warmup_sec": timer() - loaded,
+            "instances": len(players)}
+
+
+def searchLimits(budget):
+    """
+    Keyword arguments for AI.search() from a client's budget of seconds,
+    depth and/or nodes, capped by the server's limits. Raises ValueError for
+    anything else.
+    >>> searchLimits({'depth': 4})
+    {'timelimit': 6.0, 'depthlimit': 4, 'nodelimit': 1000000}
+    >>> searchLimits({'seconds': 60, 'nodes': 500})
+    {'timelimit': 6.0, 'depthlimit': 12, 'nodelimit': 500}
+    """
+    if not isinstance(budget, dict) or set(budget) - {'seconds', 'depth',
+                                                      'nodes'}:
+        raise ValueError(budget)
+    seconds = float(budget.get('seconds', MAX_SEARCH_SECS))
+    depth = int(budget.get('depth', MAX_SEARCH_DEPTH))
+    nodes = int(budget.get('nodes', MAX_SEARCH_NODES))
+    if seconds <= 0 or depth < 1 or nodes < 1:
+        raise ValueError(budget)
+    return {"timelimit": min(seconds, MAX_SEARCH_SECS),
+            "depthlimit": min(depth, MAX_SEARCH_DEPTH),
+            "nodelimit": min(nodes, MAX_SEARCH_NODES)}
+
+
+def aiMove(ainame, gamestate, timeout=None):
+    """
+    What move does the ai make at this game state? Raises AIBusy when no
+    instance of the ai is free within timeout seconds.
+    """
+    return aiMoveStats(ainame, gamestate, timeout)[0]
+
+
+def aiMoveStats(ainame, gamestate, timeout=None, limits=None):
+    """
+    The ai's move and its lastMoveStats (None if it has none, or the move
+    was cached or batched). Searching ais search within limits, from
+    searchLimits(), when given.
+    """
+    if limits is not None:
+        with getPool(ainame).player(timeout) as player:
+            move = play(ainame, player, gamestate, **limits)
+            return (move, player.lastMoveStats)
+    key = cacheKeys(ainame, [gamestate])[0]
+    if key is not None:
+        move = getCache().get(key)
+        if move is not None:
+            return (move, None)
+    stats = None
+    batcher = getBatcher(ainame)
+    if batcher is not None:
+        move = batcher.move(gamestate)
+    else:
+        with getPool(ainame).player(timeout) as player:
+            move = play(ainame, player, gamestate)
+            stats = player.lastMoveStats
+    if key is not None:
+        getCache().put(key, move)
+    return (move, stats)
+
+
+def aiMoves(ainame, gamestates, timeout=None):
+    """
+    The moves the ai makes at each of the game states, using one instance of
+    it and, for a network, one forward pass.
+    """
+    keys = cacheKeys(ainame, gamestates)
+    moves = [None if k is None else getCache().get(k) for k in keys]
+    todo = [i for i, m in enumerate(moves) if m is None]
+    if not todo:
+        return moves
+    with getPool(ainame).player(timeout) as player:
+        if isNetwork(ainame):
+            played = forwardPass(ainame, player,
+                                 [gamestates[i] for i in todo])
+        else:
+            played = [play(ainame, player, gamestates[i]) for i in todo]
+    for i, move in zip(todo, played):
+        moves[i] = move
+        if keys[i] is not None:
+            getCache().put(keys[i], move)
+    return moves
+
+
+def aiSearch(ainame, gamestate, onDepth, stop, timeout=None, limits=None):
+    """
+    Like aiMoveStats, for ais with an iterative deepening search(): calls
+    onDepth(depth, move, stats) as each depth is finished, and setting the
+    stop event ends the search with the best move so far. Other ais just
+    move.
+    """
+    with getPool(ainame).player(timeout) as player:
+        move = play(ainame, player, gamestate, onDepth=onDepth, stop=stop,
+                    **(limits or {}))
+        return (move, player.lastMoveStats)
 
 
-def aiMove(ainame, gamestate):
+def aiPonder(ainame, gamestates, stop, results, limits=None):
     """
-    What move does the ai make at this game state?
+    Work out the ai's moves at gamestates in the background, e.g. at the
+    positions an opponent's moves lead to while they think. Adds
+    results[tuple(gamestate)] = (move, stats) as each is finished, until
+    stop is set. Only uses an idle instance of the ai, which is given back
+    as soon as a request has to wait for one; a search cut short is thrown
+    away.
     """
-    global modules
-    global players
-    if ainame not in modules:
-        sys.path.append('./mancala')  # Fix the path
-        modules[ainame] = importlib.import_module('ai.' + ainame)
-        sys.path.pop()                # Undo the path.append
-    if ainame not in players:
-        players[ainame] = modules[ainame].AI()
-    return players[ainame].move(gamestate)
+    with getPool(ainame).spare(stop) as player:
+        if player is None:
+            return
+        if isNetwork(ainame):
+            moves = forwardPass(ainame, player, gamestates)
+            for gamestate, move in zip(gamestates, moves):
+                results[tuple(gamestate)] = (move, None)
+            return
+        for gamestate in gamestates:
+            if stop.is_set():
+                return
+            move = play(ainame, player, gamestate, stop=stop,
+                        **(limits or {}))
+            if stop.is_set():
+                return
+            results[tuple(gamestate)] = (move, player.lastMoveStats)
@@ -3,6 +3,8 @@ import importlib
 import sys
 import logging
 from time import process_time
+from options import splitOptions
+import profiler
 
 
 root = logging.getLogger('root')
@@ -37,7 +39,7 @@ def play_game(players):
     while not done:
         # do move for someone
         player = s.getCurrentPlayer(game)
-        move = players[player]['ai'].move(game)
+        move = profiler.move(players[player]['ai'], game)
         if move is None:
             print("null move! ", game)
         mt = {
@@ -76,7 +78,12 @@ def play_series(players, count):
                                   avg, games))
 
 
-def main(name1="luck", name2="luck", count=1, logfile='trainingmoves.jsonl'):
+def main(name1="luck", name2="luck", count=1, logfile='trainingmoves.jsonl',
+         profile=None):
+    '''
+    With profile (--profile[=file.json]) the move latency of both AIs is
+    shown at the end and written to the file.
+    '''
     print("{} vs {} for {} games!".format(name1, name2, count))
     setupLogFile(logfile)
     players = []
@@ -87,8 +94,13 @@ def main(name1="luck", name2="luck", count=1, logfile='trainingmoves.jsonl'):
         player['name'] = p
         players.append(player)
 
+    if profile:
+        profiler.start()
     play_series(players, count)
+    if profile:
+        profiler.finish(profile)
 
 
 if __name__ == '__main__':
-    main(*sys.argv[1:])
+    (args, options) = splitOptions(sys.argv[1:])
+    main(*args, profile=options.get('profile'))
@@ -0,0 +1,140 @@
+import threading
+from timeit import default_timer as timer
+
+# Micro-batching of move requests for one network. The first request to
+# arrive waits up to maxWait seconds for others, or until there are maxBatch
+# of them, then chooses all of their moves with one forward pass
+# (PolicyBase.getMoves) and hands each request its move. No thread of its
+# own: whichever request leads a batch runs it, and if more requests came in
+# than fit in it, the first of those leads the next batch.
+
+MAX_WAIT = 0.002
+MAX_BATCH = 16
+
+
+class Request():
+
+    def __init__(self, state):
+        self.state = state
+        self.queued = timer()
+        self.move = None
+        self.error = None
+        self.done = False
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.move
+
+
+class BatchStats():
+
+    def __init__(self):
+        self.batches = 0
+        self.requests = 0
+        self.sizes = {}
+        self.waitSum = 0
+        self.waitMax = 0
+        self.runSum = 0
+
+    def add(self, batch, started, secs):
+        self.batches += 1
+        self.requests += len(batch)
+        self.sizes[len(batch)] = self.sizes.get(len(batch), 0) + 1
+        for r in batch:
+            wait = started - r.queued
+            self.waitSum += wait
+            self.waitMax = max(self.waitMax, wait)
+        self.runSum += secs
+
+    def report(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "batch_avg": self.requests / max(1, self.batches),
+            "batch_sizes": dict(sorted(self.sizes.items())),
+            "added_ms_avg": self.waitSum / max(1, self.requests) * 1000,
+            "added_ms_max": self.waitMax * 1000,
+            "batch_ms_avg": self.runSum / max(1, self.batches) * 1000,
+        }
+
+
+class MoveBatcher():
+    """
+    getMoves(states) chooses the moves for a list of states at once.
+
+    >>> b = MoveBatcher(lambda states: [len(states)] * len(states),
+    ...                 maxWait=5, maxBatch=3)
+    >>> moves = []
+    >>> threads = [threading.Thread(target=lambda: moves.append(b.move([])))
+    ...            for _ in range(3)]
+    >>> for t in threads:
+    ...     t.start()
+    >>> for t in threads:
+    ...     t.join()
+    >>> moves, b.report()['batch_sizes']
+    ([3, 3, 3], {3: 1})
+    """
+
+    def __init__(self, getMoves, maxWait=MAX_WAIT, maxBatch=MAX_BATCH):
+        self.getMoves = getMoves
+        self.maxWait = maxWait
+        self.maxBatch = maxBatch
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.collecting = False
+        self.stats = BatchStats()
+
+    def move(self, state):
+        request = Request(state)
+        with self.cond:
+            self.waiting.append(request)
+            self.cond.notify_all()
+            while not request.done:
+                if (self.waiting and self.waiting[0] is request
+                        and not self.collecting):
+                    batch = self.collect()
+                    break
+                self.cond.wait()
+            else:
+                return request.result()
+        self.run(batch)
+        return request.result()
+
+    def collect(self):
+        '''
+        Called holding cond by the request at the head of the queue. Waits
+        for the batch to fill up and takes it off the queue.
+        '''
+        self.collecting = True
+        deadline = timer() + self.maxWait
+        while len(self.waiting) < self.maxBatch:
+            remaining = deadline - timer()
+            if remaining <= 0:
+                break
+            self.cond.wait(remaining)
+        batch = self.waiting[:self.maxBatch]
+        del self.waiting[:self.maxBatch]
+        self.collecting = False
+        # wake the head of what is left, to lead the next batch
+        self.cond.notify_all()
+        return batch
+
+    def run(self, batch):
+        started = timer()
+        try:
+            moves = self.getMoves([r.state for r in batch])
+            for r, move in zip(batch, moves):
+                r.move = move
+        except Exception as e:
+            for r in batch:
+                r.error = e
+        with self.cond:
+            self.stats.add(batch, started, timer() - started)
+            for r in batch:
+                r.done = True
+            self.cond.notify_all()
+
+    def report(self):
+        with self.cond:
+            return self.stats.report()
@@ -0,0 +1,85 @@
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+from ai.lib.nn_lib import NetworkBase, sampleWeights
+from prefetch import batched
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Train several AI players on the same moves. Labels are computed once per
+# batch, inputs are encoded once per distinct makeInputVector, and the
+# networks train concurrently in threads. Each network has its own graph and
+# session, and tensorflow releases the GIL while it runs a step.
+
+
+def encodingKey(nn, method):
+    """
+    Networks share an encoding when they use the same function for it.
+    >>> class A():
+    ...     def makeInputVector(self, state):
+    ...         return state
+    >>> class B(A):
+    ...     pass
+    >>> class C(A):
+    ...     def makeInputVector(self, state):
+    ...         return state[:1]
+    >>> key = encodingKey(A(), 'makeInputVector')
+    >>> key == encodingKey(B(), 'makeInputVector')
+    True
+    >>> key == encodingKey(C(), 'makeInputVector')
+    False
+    """
+    return getattr(type(nn), method)
+
+
+def groupBy(networks, method):
+    groups = {}
+    for nn in networks:
+        groups.setdefault(encodingKey(nn, method), []).append(nn)
+    return groups
+
+
+class TrainingCoordinator():
+
+    def __init__(self, players, threads=None):
+        self.players = players
+        self.networks = [p.nn for p in players
+                         if isinstance(getattr(p, 'nn', None), NetworkBase)]
+        self.others = [p for p in players
+                       if not isinstance(getattr(p, 'nn', None), NetworkBase)]
+        self.pool = ThreadPoolExecutor(
+            max_workers=threads or max(1, len(self.networks)))
+
+    def encode(self, batch):
+        '''
+        Returns a list of (network, inputs, labels, weights) with each
+        distinct encoding computed only once.
+        '''
+        jobs = []
+        weights = sampleWeights(batch)
+        for labelGroup in groupBy(self.networks, 'encodeLabels').values():
+            labels = labelGroup[0].encodeLabels(batch)
+            for group in groupBy(labelGroup, 'makeInputVector').values():
+                inputs = group[0].encodeInputs(batch)
+                jobs += [(nn, inputs, labels, weights) for nn in group]
+        return jobs
+
+    def trainBatch(self, batch):
+        start = timer()
+        jobs = self.encode(batch)
+        encoded = timer()
+        futures = [self.pool.submit(nn.trainEncoded, inputs, labels, weights)
+                   for nn, inputs, labels, weights in jobs]
+        for f in futures:
+            f.result()
+        end = timer()
+        msg = "{} networks trained {} moves: encode {} sec, train {} sec"
+        logger.debug(msg.format(len(jobs), len(batch),
+                                round(encoded - start, 3),
+                                round(end - encoded, 3)))
+
+    def train(self, data, batch_size):
+        for batch in batched(data, batch_size):
+            self.trainBatch(batch)
+        for p in self.others:
+            p.train(data=data, batch_size=batch_size)
@@ -0,0 +1,92 @@
+import glob
+import gzip
+import json
+import os
+import sys
+from timeit import default_timer as timer
+from prefetch import readTrainingFile
+from ai.lib.move_scoring import moveToVector
+
+# Self-play files repeat the opening and common positions thousands of times.
+# This reads a directory of them and writes one row per distinct position,
+# seen from the player to move:
+#
+#   [board, target, weight]
+#
+# where target is the mean of the labels of every row for that board and
+# weight is how many rows there were. The cost is linear in the labels, so
+# training on an aggregated row with its weight gives the same gradient as
+# training on all of the rows it replaces. NetworkBase reads either format.
+#
+#   python mancala/dedup.py training training_dedup
+
+ROWS_PER_FILE = 200000
+DIGITS = 4
+
+
+class Aggregate():
+
+    def __init__(self):
+        self.positions = {}
+        self.rows = 0
+
+    def add(self, row):
+        """
+        >>> a = Aggregate()
+        >>> board = [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]
+        >>> for row in [[board, 2, 1, 30, 18], [board, 2, 1, 28, 20],
+        ...             [board, 3, 0, 20, 28]]:
+        ...     a.add(row)
+        >>> [(len(b), t, w) for b, t, w in a.rows_out()]
+        [(15, [0.0538, 0.0538, 1.0, 0.0601, 0.1077, 0.1077], 3)]
+        """
+        self.rows += 1
+        key = tuple(row[0])
+        label = moveToVector(*row)
+        entry = self.positions.get(key)
+        if entry is None:
+            self.positions[key] = [label, 1]
+            return
+        entry[0] = [x + y for x, y in zip(entry[0], label)]
+        entry[1] += 1
+
+    def rows_out(self):
+        for board, (total, count) in self.positions.items():
+            target = [round(x / count, DIGITS) for x in total]
+            yield [list(board), target, count]
+
+
+def writeRows(rows, directory, compress=False):
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    out = None
+    for n, row in enumerate(rows):
+        if n % ROWS_PER_FILE == 0:
+            if out is not None:
+                out.close()
+            name = os.path.join(directory, 'dedup-{:05d}.jsonl'.format(
+                n // ROWS_PER_FILE))
+            out = gzip.open(name, 'wt') if compress else open(name, 'w')
+            files.append(name)
+        out.write(json.dumps(row) + '\n')
+    if out is not None:
+        out.close()
+    return files
+
+
+def main(directory="training", output="training_dedup", *args):
+    start = timer()
+    aggregate = Aggregate()
+    for filename in sorted(glob.glob(directory + '/*.jsonl*')):
+        for row in readTrainingFile(filename):
+            aggregate.add(row)
+    unique = len(aggregate.positions)
+    files = writeRows(aggregate.rows_out(), output, '--compress' in args)
+    reduction = 1 - unique / max(1, aggregate.rows)
+    print("{} rows -> {} positions ({}% fewer) in {} files, {} sec".format(
+        aggregate.rows, unique, round(reduction * 100, 1), len(files),
+        round(timer() - start, 3)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,174 @@
+import glob
+import json
+import math
+import os
+import sys
+from timeit import default_timer as timer
+import game_state as s
+from ai import _abpwm
+from options import splitOptions, spawnContext
+from prefetch import readTrainingFile
+from quantize import samplePositions
+
+# Label positions with the alpha-beta search, so networks can learn from its
+# judgement of every move instead of only from who won a noisy game. Each
+# legal move of a position is searched to the same depth, and the values
+# become a soft target with a softmax. Rows are written in the aggregated
+# format of dedup.py, [board, target, weight], followed by the raw values,
+# so train.py and NetworkBase.train read them as they are:
+#
+#   python mancala/distill.py 20000 --depth=4 --workers=4
+#   python mancala/train.py nn1h128 training_distill
+#
+# Rows are appended as positions finish, and positions already in the output
+# are skipped, so a stopped run picks up where it left off.
+
+DEPTH = 4
+# search values are in beads, a lower temperature makes targets sharper
+TEMPERATURE = 2.0
+OUTPUT = 'training_distill/abpwm.jsonl'
+CHUNK = 16
+
+
+def negamax(node, depth, alpha=-math.inf, beta=math.inf):
+    '''
+    Value of node for the player to move, searching whole turns (move
+    chains) like _abpwm, with the same evaluation.
+    '''
+    (chains, moves) = _abpwm.genMoves(node)
+    if depth == 0 or not chains:
+        # computeScore favours the player who just moved
+        return -_abpwm.computeScore(node)
+    best = -math.inf
+    for chain in chains:
+        child = _abpwm.applyMove(node, chain)
+        value = childValue(node, child, depth - 1, alpha, beta)
+        best = max(best, value)
+        alpha = max(alpha, value)
+        if alpha >= beta:
+            break
+    return best
+
+
+def childValue(node, child, depth, alpha=-math.inf, beta=math.inf):
+    if s.getCurrentPlayer(child) == s.getCurrentPlayer(node):
+        # the game ended during the chain and the turn never passed
+        return negamax(child, depth, alpha, beta)
+    return -negamax(child, depth, -beta, -alpha)
+
+
+def moveValues(board, depth=DEPTH):
+    """
+    Search value of each of the six moves for the player to move, None for
+    illegal moves. Each move is searched with a full window, so the values
+    are exact rather than bounds. A move which gives another turn is valued
+    by its best continuation.
+    >>> moveValues([1, 2, 4, 4, 5, 6, 0, 12, 11, 10, 9, 8, 7, 0, 0], 1)
+    [-35, -35, -34, -36, -40, -44]
+    """
+    (chains, moves) = _abpwm.genMoves(board)
+    values = [None] * 6
+    for chain in chains:
+        child = _abpwm.applyMove(board, chain)
+        value = childValue(board, child, depth - 1)
+        m = chain[0] % 7
+        if values[m] is None or value > values[m]:
+            values[m] = value
+    return values
+
+
+def softTarget(values, temperature=TEMPERATURE):
+    """
+    >>> softTarget([1, None, 1, None, None, None])
+    [0.5, 0.0, 0.5, 0.0, 0.0, 0.0]
+    """
+    legal = [v for v in values if v is not None]
+    top = max(legal)
+    weights = [0.0 if v is None else math.exp((v - top) / temperature)
+               for v in values]
+    total = sum(weights)
+    return [round(w / total, 4) for w in weights]
+
+
+def labelPositions(task):
+    (boards, depth, temperature) = task
+    rows = []
+    for board in boards:
+        values = moveValues(board, depth)
+        rows.append([board, softTarget(values, temperature), 1, values])
+    return rows
+
+
+def positionsFrom(directory, count):
+    '''
+    Distinct boards from saved self-play, already seen from the player to
+    move.
+    '''
+    seen = set()
+    boards = []
+    for filename in sorted(glob.glob(directory + '/*.jsonl*')):
+        for row in readTrainingFile(filename):
+            key = tuple(row[0])
+            if key not in seen and not s.isGameOver(row[0]):
+                seen.add(key)
+                boards.append(row[0])
+                if len(boards) >= count:
+                    return boards
+    return boards
+
+
+def randomPositions(count, seed=0):
+    return [s.flipBoardCurrentPlayer(p)
+            for p in samplePositions(count, seed)]
+
+
+def finished(output):
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'r') as f:
+        for line in f:
+            try:
+                done.add(tuple(json.loads(line)[0]))
+            except ValueError:
+                continue
+    return done
+
+
+def main(count="10000", *args):
+    (_, options) = splitOptions(args)
+    depth = int(options.get('depth', DEPTH))
+    temperature = float(options.get('temperature', TEMPERATURE))
+    workers = int(options.get('workers', os.cpu_count() or 1))
+    output = options.get('output', OUTPUT)
+    if options.get('from'):
+        boards = positionsFrom(options['from'], int(count))
+    else:
+        boards = randomPositions(int(count), int(options.get('seed', 0)))
+    done = finished(output)
+    todo = []
+    for b in boards:
+        if tuple(b) not in done:
+            done.add(tuple(b))
+            todo.append(b)
+    print("{} positions, {} to label".format(len(boards), len(todo)))
+    tasks = [(todo[i:i + CHUNK], depth, temperature)
+             for i in range(0, len(todo), CHUNK)]
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    start = timer()
+    labelled = 0
+    ctx = spawnContext()
+    with ctx.Pool(workers) as pool, \
+            open(output, 'a') as out:
+        for rows in pool.imap_unordered(labelPositions, tasks):
+            for row in rows:
+                out.write(json.dumps(row) + '\n')
+            out.flush()
+            labelled += len(rows)
+            rate = labelled / (timer() - start)
+            print("labelled {}/{} positions, {} positions/sec".format(
+                labelled, len(todo), round(rate, 2)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
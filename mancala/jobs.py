@@ -0,0 +1,176 @@
+import queue
+import threading
+import uuid
+from collections import OrderedDict
+from timeit import default_timer as timer
+from profiler import LatencyHistogram
+
+# A bounded queue of jobs run by a fixed number of worker threads, for work
+# too slow to do while a client waits on its request, like a timed search.
+# Clients submit a job, get its id back at once, and poll for the result.
+# Finished jobs are kept for keepSecs, so clients have time to fetch them.
+
+WORKERS = 2
+MAX_QUEUED = 100
+KEEP_SECS = 300
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job():
+
+    def __init__(self, fn, args):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.state = 'queued'
+        self.submitted = timer()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def summary(self):
+        summary = {"job": self.id, "state": self.state}
+        if self.started is not None:
+            summary['wait_ms'] = (self.started - self.submitted) * 1000
+        if self.finished is not None:
+            summary['run_ms'] = (self.finished - self.started) * 1000
+        if self.state == 'done':
+            summary['result'] = self.result
+        if self.state == 'failed':
+            summary['error'] = self.error
+        return summary
+
+
+class JobQueue():
+    """
+    >>> jobs = JobQueue(workers=1, maxQueued=2)
+    >>> job = jobs.submit(sum, [1, 2, 3])
+    >>> jobs.wait(job.id, 5).summary()['result']
+    6
+    >>> jobs.wait(jobs.submit(int, 'x').id, 5).state
+    'failed'
+    >>> r = jobs.report()
+    >>> r['completed'], r['failed'], r['queued']
+    (1, 1, 0)
+    """
+
+    def __init__(self, workers=WORKERS, maxQueued=MAX_QUEUED,
+                 keepSecs=KEEP_SECS):
+        self.workers = workers
+        self.keepSecs = keepSecs
+        self.pending = queue.Queue(maxQueued)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.waits = LatencyHistogram()
+        self.runs = LatencyHistogram()
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, fn, *args):
+        '''
+        Queue fn(*args), raises QueueFull when there are too many jobs
+        waiting.
+        '''
+        self.start()
+        job = Job(fn, args)
+        with self.lock:
+            self.forget()
+            try:
+                self.pending.put_nowait(job)
+            except queue.Full:
+                self.rejected += 1
+                raise QueueFull("{} jobs are waiting".format(
+                    self.pending.qsize()))
+            self.jobs[job.id] = job
+            self.submitted += 1
+        return job
+
+    def forget(self):
+        # jobs finish roughly in the order they were submitted, so the old
+        # finished ones are at the front
+        now = timer()
+        for jobId, job in list(self.jobs.items()):
+            if job.finished is None or now - job.finished < self.keepSecs:
+                break
+            del self.jobs[jobId]
+
+    def get(self, jobId):
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def wait(self, jobId, timeout):
+        '''
+        The job, once it is finished or timeout seconds have passed. None
+        when there is no such job.
+        '''
+        job = self.get(jobId)
+        if job is not None:
+            job.done.wait(timeout)
+        return job
+
+    def work(self):
+        while True:
+            job = self.pending.get()
+            with self.lock:
+                self.running += 1
+                job.state = 'running'
+                job.started = timer()
+                self.waits.add(job.started - job.submitted)
+            try:
+                job.result = job.fn(*job.args)
+                state = 'done'
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                state = 'failed'
+            with self.lock:
+                job.finished = timer()
+                job.state = state
+                self.runs.add(job.finished - job.started)
+                self.running -= 1
+                if state == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            job.done.set()
+
+    def waitTimes(self):
+        '''
+        A copy of the histogram of seconds jobs waited in the queue.
+        '''
+        with self.lock:
+            waits = LatencyHistogram()
+            waits.merge(self.waits)
+            return waits
+
+    def report(self):
+        with self.lock:
+            return {
+                "workers": self.workers,
+                "queued": self.pending.qsize(),
+                "running": self.running,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_ms_p50": self.waits.percentile(50) * 1000,
+                "wait_ms_p95": self.waits.percentile(95) * 1000,
+                "wait_ms_max": self.waits.max * 1000,
+                "run_ms_mean": (self.runs.total / max(1, self.runs.count)
+                                * 1000),
+            }
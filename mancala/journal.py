@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+
+# Append-only record of finished games, one json object per line:
+#
+#   {"key": "0:2:luck:greedy", "players": ["luck", "greedy"], "winner": 0,
+#    "times": [0.0004, 0.0011]}
+#
+# The key identifies a game (for tournaments it is the game's seed), times are
+# the seconds each seat spent choosing moves. A run that writes a journal can
+# be stopped at any point and resumed, and journals from several runs can be
+# merged. A line cut short by a crash is ignored when reading.
+
+
+def readRecords(filename):
+    """
+    Records from a journal by key, the first record of a key wins.
+    """
+    records = {}
+    if not os.path.exists(filename):
+        return records
+    with open(filename, 'r') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records.setdefault(record['key'], record)
+    return records
+
+
+def endsWithNewline(filename):
+    with open(filename, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+class Journal():
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.records = readRecords(filename)
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        self.file = open(filename, 'a')
+        if self.file.tell() and not endsWithNewline(filename):
+            # finish a line cut short by a crash, so it stays on its own
+            self.file.write('\n')
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def write(self, key, names, winner, times=None):
+        record = {'key': key, 'players': list(names), 'winner': winner}
+        if times is not None:
+            record['times'] = [round(t, 6) for t in times]
+        self.records[key] = record
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def resultTable(records, names):
+    """
+    The resultList of tournament.py and random_train.py for these names,
+    from journal records.
+    >>> recs = [{'key': 'a', 'players': ['x', 'y'], 'winner': 1},
+    ...         {'key': 'b', 'players': ['x', 'z'], 'winner': 0}]
+    >>> resultTable(recs, ['x', 'y'])
+    [[[0, 0, 0], [0, 0, 1]], [[0, 0, 0], [0, 0, 0]]]
+    """
+    index = {name: i for i, name in enumerate(names)}
+    table = [[[0, 0, 0] for _ in names] for _ in names]
+    for r in records:
+        (a, b) = r['players']
+        if a in index and b in index:
+            table[index[a]][index[b]][r['winner'] + 1] += 1
+    return table
+
+
+def moveTimes(records):
+    """
+    Average seconds per game spent choosing moves, by player.
+    >>> moveTimes([{'players': ['x', 'y'], 'times': [0.25, 0.5]},
+    ...            {'players': ['y', 'x'], 'times': [0.5, 0.75]}])
+    {'x': 0.5, 'y': 0.5}
+    """
+    totals = {}
+    for r in records:
+        for name, t in zip(r['players'], r.get('times', [])):
+            (s, n) = totals.get(name, (0, 0))
+            totals[name] = (s + t, n + 1)
+    return {name: s / n for name, (s, n) in sorted(totals.items())}
+
+
+def printTimes(times):
+    for name, t in times.items():
+        print("{:>12} {} ms/game".format(name, round(t * 1000, 3)))
+
+
+def merge(out, *filenames):
+    '''
+    Combine journals, keeping one record per game.
+    '''
+    journal = Journal(out)
+    for filename in filenames:
+        for key, r in readRecords(filename).items():
+            if key not in journal:
+                journal.write(key, r['players'], r['winner'], r.get('times'))
+    journal.close()
+    return len(journal.records)
+
+
+def main(command="table", *args):
+    '''
+    journal.py table FILE...       results and move times of the journals
+    journal.py merge OUT FILE...   merge journals into OUT
+    '''
+    from print_table import printTable
+    if command == 'merge':
+        print("{} games in {}".format(merge(*args), args[0]))
+        return
+    records = {}
+    for filename in args:
+        for key, r in readRecords(filename).items():
+            records.setdefault(key, r)
+    records = list(records.values())
+    names = sorted({n for r in records for n in r['players']})
+    printTable(resultTable(records, names), names)
+    printTimes(moveTimes(records))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
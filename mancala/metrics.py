@@ -0,0 +1,160 @@
+import math
+import threading
+
+# Metrics in the Prometheus text exposition format, for the web API's
+# /metrics. Counters, gauges and histograms are kept here with a lock each,
+# so recording is a dict update. Figures which other modules already keep
+# (pools, the move cache, jobs) are turned into samples when /metrics is
+# scraped instead of being recorded twice.
+
+# seconds, for request latency
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5,
+           5, 10)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def formatValue(value):
+    """
+    >>> formatValue(3), formatValue(0.25), formatValue(math.inf)
+    ('3', '0.25', '+Inf')
+    """
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def sample(name, labels, value):
+    """
+    >>> sample('requests_total', {'route': '/aimove'}, 2)
+    'requests_total{route="/aimove"} 2'
+    """
+    if not labels:
+        return '{} {}'.format(name, formatValue(value))
+    text = ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels.items())
+    return '{}{{{}}} {}'.format(name, text, formatValue(value))
+
+
+def header(name, kind, help):
+    return ['# HELP {} {}'.format(name, help),
+            '# TYPE {} {}'.format(name, kind)]
+
+
+class Counter():
+    """
+    >>> c = Counter('requests_total', 'Requests.', ['route'])
+    >>> c.inc('/new')
+    >>> c.inc('/new')
+    >>> c.lines()[2:]
+    ['requests_total{route="/new"} 2']
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = list(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labelValues, amount=1):
+        with self.lock:
+            self.values[labelValues] = self.values.get(labelValues, 0) + amount
+
+    def lines(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return header(self.name, self.kind, self.help) + [
+            sample(self.name, dict(zip(self.labels, k)), v)
+            for k, v in values]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, *labelValues):
+        with self.lock:
+            self.values[labelValues] = value
+
+
+class Histogram():
+    """
+    >>> h = Histogram('latency_seconds', 'Latency.', ['route'], [0.1, 1])
+    >>> h.observe(0.05, '/new')
+    >>> h.observe(0.5, '/new')
+    >>> for line in h.lines()[2:]:
+    ...     print(line)
+    latency_seconds_bucket{route="/new",le="0.1"} 1
+    latency_seconds_bucket{route="/new",le="1"} 2
+    latency_seconds_bucket{route="/new",le="+Inf"} 2
+    latency_seconds_sum{route="/new"} 0.55
+    latency_seconds_count{route="/new"} 2
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = list(labels)
+        self.buckets = list(buckets)
+        # label values -> [count per bucket, sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labelValues):
+        with self.lock:
+            entry = self.values.get(labelValues)
+            if entry is None:
+                entry = [[0] * len(self.buckets), 0, 0]
+                self.values[labelValues] = entry
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def lines(self):
+        with self.lock:
+            values = sorted((k, [list(v[0]), v[1], v[2]])
+                            for k, v in self.values.items())
+        lines = header(self.name, self.kind, self.help)
+        for k, (counts, total, count) in values:
+            labels = dict(zip(self.labels, k))
+            seen = 0
+            for bound, n in zip(self.buckets + [math.inf], counts + [0]):
+                seen += n
+                lines.append(sample(self.name + '_bucket',
+                                    dict(labels, le=formatValue(bound)),
+                                    count if math.isinf(bound) else seen))
+            lines.append(sample(self.name + '_sum', labels, round(total, 6)))
+            lines.append(sample(self.name + '_count', labels, count))
+        return lines
+
+
+def summary(name, help, histograms, label):
+    '''
+    Summary lines from profiler.LatencyHistograms by the value of label.
+    '''
+    lines = header(name, 'summary', help)
+    for value, h in sorted(histograms.items()):
+        for q in QUANTILES:
+            lines.append(sample(name, {label: value, 'quantile': q},
+                                h.percentile(q * 100)))
+        lines.append(sample(name + '_sum', {label: value}, h.total))
+        lines.append(sample(name + '_count', {label: value}, h.count))
+    return lines
+
+
+def gauge(name, help, samples, kind='gauge'):
+    '''
+    Lines for a metric given as [(labels, value)].
+    '''
+    return header(name, kind, help) + [sample(name, labels, value)
+                                       for labels, value in samples]
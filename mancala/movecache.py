@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+# Least recently used cache of AI moves, for AIs which always choose the same
+# move in the same position. Keys are (ai name, version, packed gamestate),
+# where the version changes whenever the AI's checkpoint does, so moves of an
+# old model are never served for a new one. Entries also expire after ttl
+# seconds.
+
+
+def packState(gamestate):
+    """
+    >>> packState([4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0])
+    b'\\x04\\x04\\x04\\x04\\x04\\x04\\x00\\x04\\x04\\x04\\x04\\x04\\x04\\x00\\x00'
+    """
+    return bytes(gamestate)
+
+
+class MoveCache():
+    """
+    >>> cache = MoveCache(2, ttl=60)
+    >>> cache.put(('greedy', 0, b'a'), 3)
+    >>> cache.put(('greedy', 0, b'b'), 4)
+    >>> cache.get(('greedy', 0, b'a'))
+    3
+    >>> cache.put(('greedy', 0, b'c'), 5)
+    >>> cache.get(('greedy', 0, b'b')) is None
+    True
+    >>> r = cache.report()
+    >>> r['hits'], r['misses'], r['evictions'], r['size']
+    (1, 1, 1, 2)
+    """
+
+    def __init__(self, maxSize, ttl):
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.expired = 0
+        # ai name -> [hits, misses]
+        self.counts = {}
+
+    def get(self, key):
+        now = timer()
+        with self.lock:
+            counts = self.counts.setdefault(key[0], [0, 0])
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[1] > self.ttl:
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                counts[1] += 1
+                return None
+            self.entries.move_to_end(key)
+            counts[0] += 1
+            return entry[0]
+
+    def put(self, key, move):
+        with self.lock:
+            self.entries[key] = (move, timer())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def report(self):
+        with self.lock:
+            hits = sum(h for h, m in self.counts.values())
+            misses = sum(m for h, m in self.counts.values())
+            return {
+                "size": len(self.entries),
+                "max_size": self.maxSize,
+                "ttl_sec": self.ttl,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / max(1, hits + misses),
+                "evictions": self.evictions,
+                "expired": self.expired,
+                "by_ai": {name: {"hits": h, "misses": m}
+                          for name, (h, m) in sorted(self.counts.items())},
+            }
@@ -1,4 +1,5 @@
 import sqlite3
+import threading
 
 dbconnection = None
 dbcursor = None
@@ -8,6 +9,10 @@ movedbfile = 'data/move-database.db'
 
 # This is a move database for the depth-first alpha-beta pruning with
 # memory ai.
+#
+# Every instance of the ai shares the one connection, which may be used from
+# several threads (e.g. by the web API), so each use of it holds dblock.
+dblock = threading.RLock()
 
 
 def hashNodes(node):
@@ -20,18 +25,22 @@ def hashNodes(node):
 
 
 def saveMoveDB():
-    dbconnection.commit()
+    with dblock:
+        dbconnection.commit()
 
 
 def loadMoveDB():
     global dbconnection
     global dbcursor
-    dbconnection = sqlite3.connect(movedbfile)
-    dbcursor = dbconnection.cursor()
-    dbcursor.executescript('''CREATE TABLE IF NOT EXISTS Nodes
-                        (nodehash text PRIMARY KEY, depth int,
-                         score int, bestmove text)
-                     ''')
+    with dblock:
+        if dbconnection is not None:
+            return
+        dbconnection = sqlite3.connect(movedbfile, check_same_thread=False)
+        dbcursor = dbconnection.cursor()
+        dbcursor.executescript('''CREATE TABLE IF NOT EXISTS Nodes
+                            (nodehash text PRIMARY KEY, depth int,
+                             score int, bestmove text)
+                         ''')
 
 
 def memorizeState(node, depth, score, bestMove):
@@ -40,13 +49,15 @@ def memorizeState(node, depth, score, bestMove):
         return
     nodehash = hashNodes(node)
     best = ','.join([str(x) for x in bestMove])
-    dbcursor.execute('''DELETE FROM Nodes WHERE nodehash=:nodehash;''',
-                     {"nodehash": nodehash})
-    dbcursor.execute('''INSERT INTO Nodes (nodehash, depth, score, bestmove)
-                     VALUES (:nodehash, :depth, :score, :bestmove); ''',
-                     {"nodehash": nodehash, "depth": depth, "score": score,
-                      "bestmove": best})
-    dbconnection.commit()
+    with dblock:
+        dbcursor.execute('''DELETE FROM Nodes WHERE nodehash=:nodehash;''',
+                         {"nodehash": nodehash})
+        dbcursor.execute('''INSERT INTO Nodes (nodehash, depth, score,
+                         bestmove)
+                         VALUES (:nodehash, :depth, :score, :bestmove); ''',
+                         {"nodehash": nodehash, "depth": depth,
+                          "score": score, "bestmove": best})
+        dbconnection.commit()
 
 
 def recallState(node):
@@ -54,9 +65,10 @@ def recallState(node):
     if dbcursor is None:
         return None
     nodehash = hashNodes(node)
-    dbcursor.execute('''SELECT depth, score, bestmove from Nodes WHERE
-            nodehash=?''', (nodehash,))
-    row = dbcursor.fetchone()
+    with dblock:
+        dbcursor.execute('''SELECT depth, score, bestmove from Nodes WHERE
+                nodehash=?''', (nodehash,))
+        row = dbcursor.fetchone()
     parsed = None
     best = None
     if row:
@@ -0,0 +1,31 @@
+import multiprocessing
+
+# Command line helpers. The scripts take positional arguments, and optional
+# settings are given anywhere on the line as --name=value.
+
+
+def splitOptions(args):
+    """
+    Separate --name=value options from positional arguments. An option with
+    no value is True.
+    >>> splitOptions(['3', '--workers=4', 'luck', '--resume'])
+    (['3', 'luck'], {'workers': '4', 'resume': True})
+    """
+    positional = []
+    options = {}
+    for arg in args:
+        if arg.startswith('--'):
+            name, sep, value = arg[2:].partition('=')
+            options[name] = value if sep else True
+        else:
+            positional.append(arg)
+    return (positional, options)
+
+
+def spawnContext():
+    """
+    The multiprocessing context for the scripts' worker processes. Workers
+    are spawned rather than forked, so they never inherit a tensorflow
+    runtime the parent has already started, which is not fork safe.
+    """
+    return multiprocessing.get_context('spawn')
@@ -0,0 +1,240 @@
+import os
+import queue
+import random
+import traceback
+import numpy as np
+from timeit import default_timer as timer
+from ai_list import makeAIList
+from ai import luck
+from ai.lib.nn_lib import NetworkBase, SAVE_PATH
+from options import spawnContext
+from trainlib import play_one_game, results
+
+# Self-play and training at the same time. Game worker processes play games
+# with their own copies of the players and put the moves into a bounded
+# queue, while the trainer (the main process) takes batches off the queue
+# and trains. After each batch the trainer publishes its weights, and
+# workers load them before their next game. Every chunk of moves carries the
+# weight version it was played with, so the trainer can report how stale
+# its training data is. A worker which fails puts its traceback on the queue
+# for the trainer to print, and the trainer gives up once every worker has
+# died.
+
+PUBLISH_PATH = SAVE_PATH + 'published/'
+GAMES_PER_CHUNK = 20
+QUEUE_SIZE = 64
+# how often the trainer looks for dead workers while it waits for games
+CHECK_SECS = 1
+
+
+class WorkerError(Exception):
+    pass
+
+
+def publishedFile(name, directory=PUBLISH_PATH):
+    return os.path.join(directory, name + '.npz')
+
+
+def networksOf(aiList):
+    return {x['name']: x['ai'].nn for x in aiList
+            if isinstance(getattr(x['ai'], 'nn', None), NetworkBase)}
+
+
+def publishWeights(networks, version, directory=PUBLISH_PATH):
+    os.makedirs(directory, exist_ok=True)
+    for name, nn in networks.items():
+        filename = publishedFile(name, directory)
+        tmp = filename + '.tmp.npz'
+        np.savez(tmp, *nn.getWeights())
+        os.replace(tmp, filename)
+    version.value += 1
+
+
+def loadWeights(networks, directory=PUBLISH_PATH):
+    for name, nn in networks.items():
+        with np.load(publishedFile(name, directory)) as data:
+            nn.setWeights([data['arr_{}'.format(i)]
+                           for i in range(len(data.files))])
+
+
+def gameWorker(names, chunks, version, stop, seed, directory=PUBLISH_PATH):
+    '''
+    Play games until told to stop, putting chunks of
+    (rows, [(i, j, winner)], weight version, seconds) on the chunks queue.
+    '''
+    try:
+        playChunks(names, chunks, version, stop, seed, directory)
+    except KeyboardInterrupt:
+        # the trainer stops the workers
+        pass
+    except Exception:
+        chunks.put(WorkerError(traceback.format_exc()))
+        raise
+
+
+def playChunks(names, chunks, version, stop, seed, directory):
+    random.seed(seed)
+    aiList = makeAIList(names)
+    networks = networksOf(aiList)
+    lucky = luck.AI()
+    loaded = 0
+    while not stop.is_set():
+        if version.value != loaded:
+            loaded = version.value
+            loadWeights(networks, directory)
+        start = timer()
+        rows = []
+        games = []
+        for _ in range(GAMES_PER_CHUNK):
+            i = random.randrange(len(aiList))
+            j = (i + random.randrange(1, max(2, len(aiList)))) % len(aiList)
+            (winner, moves) = play_one_game([aiList[i], aiList[j]], lucky)
+            rows += moves
+            games.append((i, j, winner))
+        chunk = (rows, games, loaded, timer() - start)
+        while not stop.is_set():
+            try:
+                chunks.put(chunk, timeout=0.5)
+                break
+            except queue.Full:
+                continue
+
+
+class PipelineMetrics():
+    '''
+    Generation rate, training rate and staleness of the data trained on.
+    '''
+
+    def __init__(self):
+        self.start = timer()
+        self.generated = 0
+        self.trained = 0
+        self.train_time = 0
+        self.batches = 0
+        self.staleSum = 0
+        self.staleMax = 0
+        self.queueSum = 0
+
+    def received(self, rows):
+        self.generated += rows
+
+    def batchTrained(self, rows, secs, versions, occupancy):
+        self.trained += rows
+        self.train_time += secs
+        self.batches += 1
+        self.staleSum += sum(versions) / max(1, len(versions))
+        self.staleMax = max([self.staleMax] + versions)
+        self.queueSum += occupancy
+
+    def report(self):
+        elapsed = max(timer() - self.start, 1e-9)
+        batches = max(1, self.batches)
+        return {
+            "generated_per_sec": self.generated / elapsed,
+            "trained_per_sec": self.trained / max(self.train_time, 1e-9),
+            "trainer_busy": self.train_time / elapsed,
+            "staleness_avg": self.staleSum / batches,
+            "staleness_max": self.staleMax,
+            "queue_avg": self.queueSum / batches,
+        }
+
+    def format(self):
+        r = self.report()
+        msg = ("generated {} rows/s | trained {} rows/s, busy {}% | "
+               "staleness avg {} max {} versions | queue avg {}")
+        return msg.format(int(r['generated_per_sec']),
+                          int(r['trained_per_sec']),
+                          int(r['trainer_busy'] * 100),
+                          round(r['staleness_avg'], 2), r['staleness_max'],
+                          round(r['queue_avg'], 1))
+
+
+def nextChunk(chunks, procs, failures):
+    '''
+    The next chunk of games from the workers. Prints the tracebacks of
+    workers which failed, adding them to failures, and raises WorkerError
+    when none is left alive.
+    '''
+    while True:
+        try:
+            item = chunks.get(timeout=CHECK_SECS)
+        except queue.Empty:
+            if any(p.is_alive() for p in procs):
+                continue
+            raise WorkerError(
+                "all {} game workers died, exit codes {}\n{}".format(
+                    len(procs), [p.exitcode for p in procs],
+                    failures[-1] if failures else ''))
+        if isinstance(item, WorkerError):
+            print("game worker failed:\n" + item.args[0])
+            failures.append(item.args[0])
+            continue
+        return item
+
+
+def run(aiList, coordinator, workers=2, batchSize=10000, seed=0,
+        onGame=None, onBatch=None, directory=PUBLISH_PATH):
+    '''
+    Train from workers' games until interrupted. onGame(i, j, winner) is
+    called for every game received and onBatch() after each batch is
+    trained. Raises WorkerError if every worker dies.
+
+    >>> import tempfile
+    >>> from ai import luck
+    >>> run([{'name': 'nosuchai', 'ai': luck.AI()}], None, workers=1,
+    ...     directory=tempfile.mkdtemp())  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+        ...
+    pipeline.WorkerError: all 1 game workers died, exit codes [1]
+    Traceback (most recent call last):
+    ...
+    ModuleNotFoundError: No module named 'ai.nosuchai'
+    <BLANKLINE>
+    '''
+    names = [x['name'] for x in aiList]
+    networks = networksOf(aiList)
+    ctx = spawnContext()
+    chunks = ctx.Queue(QUEUE_SIZE)
+    version = ctx.Value('i', 0)
+    stop = ctx.Event()
+    publishWeights(networks, version, directory)
+    procs = [ctx.Process(target=gameWorker,
+                         args=(names, chunks, version, stop, seed + w,
+                               directory),
+                         daemon=True)
+             for w in range(workers)]
+    for p in procs:
+        p.start()
+    metrics = PipelineMetrics()
+    pending = []
+    versions = []
+    failures = []
+    try:
+        while True:
+            (rows, games, played, secs) = nextChunk(chunks, procs, failures)
+            metrics.received(len(rows))
+            for row in rows:
+                results.info(row)
+            if onGame is not None:
+                for (i, j, winner) in games:
+                    onGame(i, j, winner)
+            pending += rows
+            versions.append(version.value - played)
+            if len(pending) < batchSize:
+                continue
+            start = timer()
+            coordinator.train(pending, batchSize)
+            publishWeights(networks, version, directory)
+            metrics.batchTrained(len(pending), timer() - start, versions,
+                                 chunks.qsize())
+            print(metrics.format())
+            pending = []
+            versions = []
+            if onBatch is not None:
+                onBatch()
+    finally:
+        stop.set()
+        for p in procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
@@ -0,0 +1,231 @@
+import gzip
+import json
+import queue
+import random
+import threading
+from timeit import default_timer as timer
+from options import spawnContext
+
+# Background data loader for training from saved game files. Files are read
+# and decoded by worker processes (or by the feeder thread when workers is 0),
+# rows are mixed across files in a bounded shuffle buffer, and finished
+# batches wait in a bounded queue for the trainer. Parsing the next files
+# overlaps with training on the current batch.
+
+SHUFFLE_BUFFER_SIZE = 200000
+QUEUE_SIZE = 4
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def openTraining(filename):
+    """
+    Open a saved training file for reading text lines, whether or not it was
+    written compressed.
+    """
+    with open(filename, 'rb') as f:
+        magic = f.read(2)
+    if magic == GZIP_MAGIC:
+        return gzip.open(filename, 'rt')
+    return open(filename, 'r')
+
+
+def parseRows(lines):
+    """
+    Decode json lines, skipping blank lines.
+    >>> parseRows(['[[1, 2], 3, 1]', '', '[[4, 5], 0, 0]'])
+    [[[1, 2], 3, 1], [[4, 5], 0, 0]]
+    """
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def readTrainingFile(filename):
+    with openTraining(filename) as infile:
+        return parseRows(infile)
+
+
+def shuffleStream(rows, bufferSize, rng=random):
+    """
+    Approximately shuffle a stream of rows using a buffer of bounded size.
+    Every row comes out exactly once.
+    >>> sorted(shuffleStream(range(10), 3))
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+    >>> list(shuffleStream(range(5), 1))
+    [0, 1, 2, 3, 4]
+    """
+    buf = []
+    for row in rows:
+        if len(buf) < bufferSize:
+            buf.append(row)
+            continue
+        i = rng.randrange(bufferSize)
+        yield buf[i]
+        buf[i] = row
+    rng.shuffle(buf)
+    yield from buf
+
+
+def batched(rows, size):
+    """
+    >>> list(batched(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    head = []
+    for row in rows:
+        head.append(row)
+        if len(head) >= size:
+            yield head
+            head = []
+    if head:
+        yield head
+
+
+class PipelineStats():
+    """
+    Throughput counters for each stage of the pipeline. The feeder thread and
+    the trainer both update these, so access is locked.
+    """
+
+    def __init__(self, totalFiles=0):
+        self.lock = threading.Lock()
+        self.start = timer()
+        self.totalFiles = totalFiles
+        self.filesParsed = 0
+        self.rowsParsed = 0
+        self.rowsTrained = 0
+        self.queueSamples = 0
+        self.queueSum = 0
+
+    def parsed(self, rows):
+        with self.lock:
+            self.filesParsed += 1
+            self.rowsParsed += rows
+
+    def trained(self, rows):
+        with self.lock:
+            self.rowsTrained += rows
+
+    def sampleQueue(self, occupancy):
+        with self.lock:
+            self.queueSamples += 1
+            self.queueSum += occupancy
+
+    def report(self):
+        with self.lock:
+            elapsed = max(timer() - self.start, 1e-9)
+            return {
+                "files_parsed": self.filesParsed,
+                "total_files": self.totalFiles,
+                "rows_parsed": self.rowsParsed,
+                "rows_trained": self.rowsTrained,
+                "parsed_per_sec": self.rowsParsed / elapsed,
+                "trained_per_sec": self.rowsTrained / elapsed,
+                "queue_avg": self.queueSum / max(1, self.queueSamples),
+                "elapsed": elapsed,
+            }
+
+    def remaining(self):
+        """
+        Estimate seconds left in this pass over the files.
+        """
+        r = self.report()
+        if not r['files_parsed'] or not r['trained_per_sec']:
+            return 0
+        rowsPerFile = r['rows_parsed'] / r['files_parsed']
+        estRows = rowsPerFile * r['total_files']
+        return max(0, estRows - r['rows_trained']) / r['trained_per_sec']
+
+    def format(self, occupancy=None):
+        r = self.report()
+        msg = ("files {}/{} | parsed {} rows at {} r/s | "
+               "trained {} rows at {} r/s | queue avg {}")
+        if occupancy is not None:
+            msg += " now {}".format(occupancy)
+        return msg.format(
+            r['files_parsed'], r['total_files'],
+            r['rows_parsed'], int(r['parsed_per_sec']),
+            r['rows_trained'], int(r['trained_per_sec']),
+            round(r['queue_avg'], 2))
+
+
+class Prefetcher():
+    """
+    Reads files in the background and yields shuffled batches of rows.
+
+        loader = Prefetcher(files, 50000)
+        for batch in loader.batches():
+            player.nn.train_batch(batch)
+            loader.stats.trained(len(batch))
+    """
+
+    _done = object()
+
+    def __init__(self, files, batch_size, workers=2,
+                 buffer_size=SHUFFLE_BUFFER_SIZE, queue_size=QUEUE_SIZE,
+                 seed=None):
+        self.files = list(files)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.buffer_size = buffer_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.rng = random.Random(seed)
+        self.stats = PipelineStats(len(self.files))
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def _parsedFiles(self):
+        if self.workers > 0:
+            ctx = spawnContext()
+            with ctx.Pool(self.workers) as pool:
+                yield from pool.imap_unordered(readTrainingFile, self.files)
+        else:
+            for f in self.files:
+                yield readTrainingFile(f)
+
+    def _rows(self):
+        for rows in self._parsedFiles():
+            self.stats.parsed(len(rows))
+            yield from rows
+            if self.stopping.is_set():
+                return
+
+    def _put(self, item):
+        while not self.stopping.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self):
+        try:
+            stream = shuffleStream(self._rows(), self.buffer_size, self.rng)
+            for batch in batched(stream, self.batch_size):
+                if not self._put(batch):
+                    return
+            self._put(self._done)
+        except Exception as e:
+            self._put(e)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+        return self
+
+    def occupancy(self):
+        return self.queue.qsize()
+
+    def batches(self):
+        if self.thread is None:
+            self.start()
+        try:
+            while True:
+                self.stats.sampleQueue(self.occupancy())
+                item = self.queue.get()
+                if item is self._done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.stopping.set()
@@ -1,15 +1,15 @@
 CELL_WIDTH = 10
 
 
-def makeHeader(names):
+def makeHeader(names, extra=[]):
     headers = []
-    header = [formatCell(n, '>') for n in [''] + names]
+    header = [formatCell(n, '>') for n in [''] + names + extra]
     headers.append('|'.join([''] + header + ['']))
     headers.append(
         '|'.join(
             [''] +
             [':' + '-' * (CELL_WIDTH - 1)] +
-            (['-' * (CELL_WIDTH - 1) + ':'] * len(names)) +
+            (['-' * (CELL_WIDTH - 1) + ':'] * (len(names) + len(extra))) +
             ['']))
     return headers
 
@@ -25,11 +25,26 @@ def formatStats(t, w, l, i, j):
     return '' if i == j else formatCell(pct, '>')
 
 
-def printTable(results, names):
+def printColumns(names, headers, rows):
+    '''
+    A table with a row of values under headers for each name.
+    '''
+    for h in makeHeader([], headers):
+        print(h)
+    for name, row in zip(names, rows):
+        print('|'.join([''] + [formatCell(x, '>') for x in [name] + row] +
+                       ['']))
+
+
+def printTable(results, names, extra=None):
+    '''
+    extra is (headers, rows) for more columns, with a row for each name.
+    '''
     numPlayers = len(names)
-    for h in makeHeader(names):
+    (extraHeaders, extraRows) = extra or ([], [[]] * numPlayers)
+    for h in makeHeader(names, extraHeaders):
         print(h)
     for i in range(numPlayers):
         res = [formatStats(*c, i, j) for j, c in enumerate(results[i])]
-        row = [formatCell(n, '>') for n in [names[i]] + res]
+        row = [formatCell(n, '>') for n in [names[i]] + res + extraRows[i]]
         print('|'.join([''] + row + ['']))
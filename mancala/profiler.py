@@ -0,0 +1,210 @@
+import json
+import math
+import os
+from timeit import default_timer as timer
+
+# Move latency profiling. While a profiler is active, every AI.move call made
+# through move() below is timed and counted by AI name, along with the moves
+# it evaluated and how deep it searched when the AI reports them in a
+# lastMoveStats dict. Latencies go into log spaced buckets, so memory stays
+# small however long a run is, percentiles are good to a few percent, and
+# profiles from several processes can be merged.
+
+BUCKET_RATIO = 1.05
+SMALLEST = 1e-6
+COLUMNS = ['p50 ms', 'p95 ms', 'p99 ms', 'evals', 'depth']
+PROFILE_FILE = 'data/profile.json'
+
+active = None
+
+
+def bucketOf(seconds):
+    """
+    >>> bucketOf(1e-6), bucketOf(2e-6) == bucketOf(2.05e-6), bucketOf(0)
+    (0, True, 0)
+    """
+    if seconds <= SMALLEST:
+        return 0
+    return int(math.log(seconds / SMALLEST) / math.log(BUCKET_RATIO))
+
+
+def bucketValue(bucket):
+    # middle of the bucket
+    return SMALLEST * BUCKET_RATIO ** (bucket + 0.5)
+
+
+class LatencyHistogram():
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        b = bucketOf(seconds)
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """
+        >>> h = LatencyHistogram()
+        >>> for ms in range(1, 101):
+        ...     h.add(ms / 1000)
+        >>> [abs(h.percentile(p) * 1000 - p) < p / 20 for p in [50, 95, 99]]
+        [True, True, True]
+        """
+        if not self.count:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for b in sorted(self.buckets):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return min(bucketValue(b), self.max)
+        return self.max
+
+    def merge(self, other):
+        for b, n in other.buckets.items():
+            self.buckets[b] = self.buckets.get(b, 0) + n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+
+class AIProfile():
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.evaluated = 0
+        self.depthSum = 0
+        self.depthMoves = 0
+        self.depthMax = 0
+
+    def add(self, seconds, stats=None):
+        self.latency.add(seconds)
+        if not stats:
+            return
+        self.evaluated += stats.get('evaluated', 0)
+        if stats.get('depth') is not None:
+            self.depthSum += stats['depth']
+            self.depthMoves += 1
+            self.depthMax = max(self.depthMax, stats['depth'])
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.evaluated += other.evaluated
+        self.depthSum += other.depthSum
+        self.depthMoves += other.depthMoves
+        self.depthMax = max(self.depthMax, other.depthMax)
+
+    def summary(self):
+        moves = self.latency.count
+        return {
+            "moves": moves,
+            "mean_ms": self.latency.total / max(1, moves) * 1000,
+            "p50_ms": self.latency.percentile(50) * 1000,
+            "p95_ms": self.latency.percentile(95) * 1000,
+            "p99_ms": self.latency.percentile(99) * 1000,
+            "max_ms": self.latency.max * 1000,
+            "moves_per_sec": moves / max(self.latency.total, 1e-9),
+            "evaluated_per_move": (self.evaluated / max(1, moves)
+                                   if self.evaluated else None),
+            "depth_avg": (self.depthSum / self.depthMoves
+                          if self.depthMoves else None),
+            "depth_max": self.depthMax if self.depthMoves else None,
+        }
+
+
+def aiName(ai):
+    """
+    >>> from ai import greedy
+    >>> aiName(greedy.AI())
+    'greedy'
+    """
+    name = getattr(getattr(ai, 'nn', None), 'name', None)
+    name = name or type(ai).__module__
+    return name[3:] if name.startswith('ai.') else name
+
+
+class MoveProfiler():
+
+    def __init__(self):
+        self.profiles = {}
+
+    def record(self, name, seconds, stats=None):
+        self.profiles.setdefault(name, AIProfile()).add(seconds, stats)
+
+    def merge(self, other):
+        for name, p in other.profiles.items():
+            self.profiles.setdefault(name, AIProfile()).merge(p)
+
+    def report(self):
+        return {name: p.summary() for name, p in sorted(self.profiles.items())}
+
+    def save(self, filename):
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def columns(self, names):
+        '''
+        Rows of COLUMNS for print_table, one per name.
+        '''
+        rows = []
+        for name in names:
+            if name not in self.profiles:
+                rows.append([''] * len(COLUMNS))
+                continue
+            r = self.profiles[name].summary()
+            rows.append([round(r['p50_ms'], 3), round(r['p95_ms'], 3),
+                         round(r['p99_ms'], 3),
+                         fmt(r['evaluated_per_move'], 1),
+                         fmt(r['depth_avg'], 2)])
+        return rows
+
+
+def fmt(value, digits):
+    return '-' if value is None else round(value, digits)
+
+
+def start():
+    global active
+    active = MoveProfiler()
+    return active
+
+
+def stop():
+    global active
+    (profiler, active) = (active, None)
+    return profiler
+
+
+def finish(filename=True):
+    '''
+    Stop profiling, print the move latency of each AI and save the report,
+    to PROFILE_FILE when filename is True (a bare --profile).
+    '''
+    from print_table import printColumns
+    profile = stop()
+    if profile is None:
+        return None
+    names = sorted(profile.profiles)
+    printColumns(names, COLUMNS, profile.columns(names))
+    profile.save(PROFILE_FILE if filename is True else filename)
+    return profile
+
+
+def move(ai, state):
+    '''
+    ai.move(state), timed when a profiler is active.
+    '''
+    if active is None:
+        return ai.move(state)
+    begin = timer()
+    result = ai.move(state)
+    active.record(aiName(ai), timer() - begin,
+                  getattr(ai, 'lastMoveStats', None))
+    return result
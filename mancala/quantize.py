@@ -0,0 +1,106 @@
+import importlib
+import random
+import sys
+from timeit import default_timer as timer
+import game_state as s
+from tournament import play_game
+from ai.lib.quantized import exportQuantized, QuantizedAI
+
+# Export a network's weights as int8 and report what the quantised player
+# costs in quality and gains in speed compared to the float32 network:
+#
+#   python mancala/quantize.py nn1h128 2000 200 greedy
+#
+# Then serve it quantised with MANCALA_QUANTIZED=nn1h128 (see aimove.py).
+
+
+def samplePositions(count, seed=0):
+    """
+    Collect positions from random games, so they look like real play.
+    >>> len(samplePositions(10))
+    10
+    """
+    rng = random.Random(seed)
+    positions = []
+    while len(positions) < count:
+        game = s.init()
+        while not s.isGameOver(game) and len(positions) < count:
+            positions.append(game)
+            game = s.doMove(game, rng.choice(s.getLegalMoves(game)))
+    return positions
+
+
+def bestMoves(nn, positions):
+    boards = [s.flipBoardCurrentPlayer(p) for p in positions]
+    y = nn.predict([nn.makeInputVector(b[:14]) for b in boards])
+    moves = [nn.chooseMoveDeterministic(list(row), s.getLegalMoves(b))
+             for b, row in zip(boards, y)]
+    return (moves, y)
+
+
+def agreement(a, b, positions):
+    """
+    Fraction of positions where both pick the same best move, and the
+    largest difference in any move score.
+    """
+    (ma, ya) = bestMoves(a, positions)
+    (mb, yb) = bestMoves(b, positions)
+    same = len([1 for x, y in zip(ma, mb) if x == y])
+    diff = max(abs(float(x) - float(y))
+               for ra, rb in zip(ya, yb) for x, y in zip(ra, rb))
+    return (same / max(1, len(positions)), diff)
+
+
+def latency(nn, positions):
+    start = timer()
+    for p in positions:
+        nn.getMove(p)
+    return (timer() - start) / max(1, len(positions))
+
+
+def winRate(player, opponent, games, seed=0):
+    """
+    Score of player against opponent, alternating who moves first. Each game
+    is seeded so two players can be compared over the same dice.
+    """
+    score = 0
+    for g in range(games):
+        random.seed('{}:{}'.format(seed, g))
+        if g % 2:
+            winner = play_game(opponent, player)
+            score += {1: 1, -1: 0.5}.get(winner, 0)
+        else:
+            winner = play_game(player, opponent)
+            score += {0: 1, -1: 0.5}.get(winner, 0)
+    return score / max(1, games)
+
+
+def main(name="nn1h128", positions="2000", games="200", opponent="greedy"):
+    module = importlib.import_module('ai.' + name)
+    original = module.AI()
+    filename = exportQuantized(original.nn)
+    print("exported {}".format(filename))
+    quant = QuantizedAI(module)
+    other = importlib.import_module('ai.' + opponent).AI()
+
+    sample = samplePositions(int(positions))
+    (agree, diff) = agreement(original.nn, quant.nn, sample)
+    print("move agreement: {}% over {} positions, max score diff {}".format(
+        round(agree * 100, 2), len(sample), round(diff, 5)))
+
+    single = sample[:500]
+    (tf_latency, q_latency) = (latency(original.nn, single),
+                               latency(quant.nn, single))
+    print("latency per move: float32 {} ms, quantised {} ms".format(
+        round(tf_latency * 1000, 4), round(q_latency * 1000, 4)))
+
+    games = int(games)
+    (wf, wq) = (winRate(original, other, games),
+                winRate(quant, other, games))
+    msg = "vs {} over {} games: float32 {}%, quantised {}%, delta {}"
+    print(msg.format(opponent, games, round(wf * 100, 1),
+                     round(wq * 100, 1), round((wq - wf) * 100, 1)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -2,10 +2,17 @@ from ai_list import makeAIList
 from ai import luck
 from random import randrange
 from trainlib import setupLogFile, play_one_game
-from time import process_time
+from timeit import default_timer as timer
 from print_table import printTable
+from coordinator import TrainingCoordinator
+from journal import Journal, resultTable
+from options import splitOptions
+import pipeline
+import profiler
 import logging
+import os
 import sys
+import time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -20,12 +27,15 @@ NUM_BATCHES = 2
 BATCH_SIZE = 10000
 MAX_MOVES = NUM_BATCHES * BATCH_SIZE - 25
 MAX_GAMES = MAX_MOVES / 20
+PROFILE_FILE = 'data/profile.json'
+# game worker processes in --pipeline mode, one core is left for training
+WORKERS = max(1, (os.cpu_count() or 2) - 1)
 
 
 def timeIt():
-    startTime = process_time()
+    startTime = timer()
     while True:
-        endTime = process_time()
+        endTime = timer()
         delta = endTime - startTime
         yield delta
         startTime = endTime
@@ -40,6 +50,7 @@ training_games = 0
 training_timer = timeIt()
 games_start = timeIt()
 batch_results = None
+coordinator = None
 
 
 def saveMoves(aiList, moves):
@@ -59,8 +70,7 @@ def saveMoves(aiList, moves):
         sec = int(games_delta * 1000) / 1000
         logger.info(msg.format(numMoves, training_games, sec))
         next(training_timer)
-        for p in aiList:
-            p['ai'].train(data=training_moves, batch_size=BATCH_SIZE)
+        coordinator.train(training_moves, BATCH_SIZE)
         train_delta = next(training_timer)
         sec = int(train_delta * 1000) / 1000
         logger.debug("Training done in {} sec".format(sec))
@@ -72,13 +82,47 @@ def saveMoves(aiList, moves):
 
 def main(args):
     global batch_results
+    global coordinator
+    (names, options) = splitOptions(args)
     setupLogFile('training/random.jsonl')
-    aiList = makeAIList(args)
+    aiList = makeAIList(names)
     numPlayers = len(aiList)
     resultList = resultsInit(numPlayers)
+    journal = None
+    if options.get('journal'):
+        # results of earlier runs carry on into this one
+        journal = Journal(options['journal'])
+        resultList = resultTable(journal.records.values(),
+                                 [x['name'] for x in aiList])
+    run = '{}.{}'.format(int(time.time()), os.getpid())
+    played = 0
     batch_results = resultsInit(numPlayers)
     lucky = luck.AI()
+    coordinator = TrainingCoordinator([p['ai'] for p in aiList])
+
+    def gameDone(i, j, winner):
+        nonlocal played
+        if journal is not None:
+            journal.write('{}:{}'.format(run, played),
+                          (aiList[i]['name'], aiList[j]['name']), winner)
+        played += 1
+        resultList[i][j][winner + 1] += 1
+        batch_results[i][j][winner + 1] += 1
+
+    def batchDone():
+        global batch_results
+        printTable(batch_results, [x['name'] for x in aiList])
+        batch_results = resultsInit(numPlayers)
+
+    if options.get('profile'):
+        # moves played in this process, so not the --pipeline workers'
+        profiler.start()
     try:
+        if options.get('pipeline'):
+            pipeline.run(aiList, coordinator,
+                         workers=int(options.get('workers', WORKERS)),
+                         batchSize=BATCH_SIZE, onGame=gameDone,
+                         onBatch=batchDone)
         while True:
             i = randrange(numPlayers)
             j = randrange(numPlayers)
@@ -88,10 +132,17 @@ def main(args):
             players = [aiList[i], aiList[j]]
             (winner, moves) = play_one_game(players, lucky)
             saveMoves(aiList, moves)
-            resultList[i][j][winner + 1] += 1
-            batch_results[i][j][winner + 1] += 1
+            gameDone(i, j, winner)
     except KeyboardInterrupt:
-        printTable(resultList, [x['name'] for x in aiList])
+        names = [x['name'] for x in aiList]
+        moveProfile = profiler.stop()
+        if moveProfile is None:
+            printTable(resultList, names)
+            return
+        printTable(resultList, names,
+                   (profiler.COLUMNS, moveProfile.columns(names)))
+        profile = options['profile']
+        moveProfile.save(PROFILE_FILE if profile is True else profile)
 
 
 if __name__ == '__main__':
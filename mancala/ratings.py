@@ -0,0 +1,178 @@
+import json
+import math
+import os
+import numpy as np
+
+# Bradley-Terry ratings on the Elo scale, fitted from head to head results.
+# Every player also gets one win and one loss against a virtual player rated
+# zero, which keeps ratings finite for unbeaten players and puts a new player
+# in the middle with a wide interval until it has played.
+
+ELO_SCALE = 400 / math.log(10)
+PRIOR_GAMES = 1
+RATINGS_FILE = 'data/ratings.json'
+# a pair is settled once its order is this certain, or once the interval on
+# their difference is narrower than RESOLUTION elo (they are about equal)
+SETTLED_UNCERTAINTY = 0.05
+RESOLUTION = 50
+
+
+def normalCdf(x):
+    """
+    >>> normalCdf(0)
+    0.5
+    """
+    return 0.5 * (1 + math.erf(x / math.sqrt(2)))
+
+
+def fitBradleyTerry(wins, prior=PRIOR_GAMES, iterations=50):
+    """
+    Fit log strengths to a matrix where wins[i][j] is the score of i against
+    j (a draw is half a win each). Returns (theta, covariance).
+
+    A 30-10 record is log(3) = 1.10 apart, a little less with the prior:
+    >>> theta, cov = fitBradleyTerry([[0, 30], [10, 0]])
+    >>> round(float(theta[0] - theta[1]), 2)
+    1.06
+    >>> bool(cov[0][0] > 0)
+    True
+    """
+    w = np.asarray(wins, dtype=float)
+    n = w + w.T
+    count = len(w)
+    theta = np.zeros(count)
+    for _ in range(iterations):
+        p = 1 / (1 + np.exp(theta[None, :] - theta[:, None]))
+        p0 = 1 / (1 + np.exp(-theta))
+        grad = (w - n * p).sum(axis=1) + prior * (1 - 2 * p0)
+        info = n * p * (1 - p)
+        hess = np.diag(info.sum(axis=1) + 2 * prior * p0 * (1 - p0)) - info
+        step = np.linalg.solve(hess, grad)
+        theta += step
+        if np.abs(step).max() < 1e-9:
+            break
+    return (theta, np.linalg.inv(hess))
+
+
+def orderUncertainty(theta, cov, i, j):
+    """
+    Probability that the fitted order of i and j is the wrong way round.
+    >>> orderUncertainty(np.array([0.0, 0.0]), np.eye(2), 0, 1)
+    0.5
+    """
+    var = cov[i][i] + cov[j][j] - 2 * cov[i][j]
+    diff = abs(theta[i] - theta[j])
+    return normalCdf(-diff / math.sqrt(max(var, 1e-12)))
+
+
+class Ratings():
+    '''
+    Head to head results by name, persisted as json so later runs only need
+    to place new players. The keys of journaled games are kept too, so a
+    journal can be merged in more than once without counting a game twice.
+    '''
+
+    def __init__(self, filename=RATINGS_FILE):
+        self.filename = filename
+        self.results = {}
+        self.keys = set()
+        if filename and os.path.exists(filename):
+            with open(filename, 'r') as f:
+                saved = json.load(f)
+            self.results = saved.get('results', {})
+            self.keys = set(saved.get('keys', []))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or '.', exist_ok=True)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'results': self.results,
+                       'ratings': self.table(sorted(self.results)),
+                       'keys': sorted(self.keys)}, f)
+        os.replace(tmp, self.filename)
+
+    def record(self, name1, name2, winner, key=None):
+        """
+        Record a game, winner is 0 for name1, 1 for name2, -1 for a draw.
+        A game with the key of one already recorded is ignored.
+        >>> r = Ratings(None)
+        >>> r.record('a', 'b', 0, key='0:0:a:b')
+        >>> r.record('b', 'a', -1)
+        >>> r.record('a', 'b', 0, key='0:0:a:b')
+        >>> r.results['a']['b'], r.results['b']['a']
+        ([1, 1, 0], [0, 1, 1])
+        """
+        if key is not None:
+            if key in self.keys:
+                return
+            self.keys.add(key)
+        for (me, other, mine) in [(name1, name2, 0), (name2, name1, 1)]:
+            row = self.results.setdefault(me, {}).setdefault(other,
+                                                             [0, 0, 0])
+            if winner == -1:
+                row[1] += 1
+            elif winner == mine:
+                row[0] += 1
+            else:
+                row[2] += 1
+
+    def games(self, name1, name2):
+        return sum(self.results.get(name1, {}).get(name2, [0, 0, 0]))
+
+    def fit(self, names):
+        wins = [[0.0] * len(names) for _ in names]
+        for i, a in enumerate(names):
+            for j, b in enumerate(names):
+                (w, d, _) = self.results.get(a, {}).get(b, [0, 0, 0])
+                wins[i][j] = w + d / 2
+        return fitBradleyTerry(wins)
+
+    def table(self, names):
+        '''
+        [(name, elo, 95% interval, games)] best first.
+        '''
+        if not names:
+            return []
+        (theta, cov) = self.fit(names)
+        rows = []
+        for i, name in enumerate(names):
+            games = sum(self.games(name, x) for x in names)
+            se = math.sqrt(max(cov[i][i], 0))
+            rows.append((name, round(float(theta[i]) * ELO_SCALE, 1),
+                         round(1.96 * se * ELO_SCALE, 1), games))
+        return sorted(rows, key=lambda x: -x[1])
+
+    def nextPairs(self, names, count=1):
+        """
+        Unsettled pairs whose order is least certain, fewest games first on
+        ties. Returns [(uncertainty, i, j)], empty when the ranking is done.
+        >>> r = Ratings(None)
+        >>> for _ in range(20):
+        ...     r.record('a', 'b', 0)
+        ...     r.record('b', 'c', -1)
+        >>> [(i, j) for u, i, j in r.nextPairs(['a', 'b', 'c'])]
+        [(1, 2)]
+        >>> for _ in range(2000):
+        ...     r.record('b', 'c', -1)
+        >>> r.nextPairs(['a', 'b', 'c'])
+        []
+        """
+        (theta, cov) = self.fit(names)
+        pairs = []
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                u = orderUncertainty(theta, cov, i, j)
+                var = cov[i][i] + cov[j][j] - 2 * cov[i][j]
+                width = 1.96 * math.sqrt(max(var, 0)) * ELO_SCALE
+                if u < SETTLED_UNCERTAINTY or width < RESOLUTION:
+                    continue
+                pairs.append((u, -self.games(names[i], names[j]), i, j))
+        pairs.sort(reverse=True)
+        return [(u, i, j) for (u, g, i, j) in pairs[:count]]
+
+
+def printRatings(rows):
+    fmt = "{:>12} {:>8} {:>8} {:>6}"
+    print(fmt.format('ai', 'elo', '+/-', 'games'))
+    for row in rows:
+        print(fmt.format(*row))
@@ -0,0 +1,158 @@
+import threading
+import uuid
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+# Games kept by the web API, so that clients of a session send only their
+# moves. Sessions are kept in the order they were last used and expire ttl
+# seconds after that. No more than maxSessions are kept: when the store is
+# full of live games, new ones are turned away rather than ending someone's
+# game early.
+
+MAX_SESSIONS = 10000
+TTL = 1800
+
+
+class StoreFull(Exception):
+    pass
+
+
+class Session():
+    '''
+    A game between a client, playing player, and an ai. While it is the
+    client's turn the ai may ponder: work out its replies to the client's
+    possible moves into pondered, until stop is set.
+    '''
+
+    def __init__(self, ainame, player, gamestate, limits=None):
+        self.id = uuid.uuid4().hex
+        self.ainame = ainame
+        self.player = player
+        self.gamestate = gamestate
+        self.limits = limits
+        # checkWin of the gamestate, worked out once per move
+        self.result = None
+        self.moves = 0
+        self.used = timer()
+        self.lock = threading.Lock()
+        self.stop = None
+        # tuple(gamestate) -> (move, stats)
+        self.pondered = None
+
+    def ponder(self):
+        '''
+        Start over pondering, returns the stop event and the dict for
+        results.
+        '''
+        self.stopPondering()
+        self.stop = threading.Event()
+        self.pondered = {}
+        return (self.stop, self.pondered)
+
+    def stopPondering(self):
+        if self.stop is not None:
+            self.stop.set()
+        self.stop = None
+        self.pondered = None
+
+    def takePondered(self, gamestate):
+        """
+        The pondered (move, stats) at gamestate, or None. Ends pondering.
+        >>> s = Session('greedy', 0, [0])
+        >>> (stop, results) = s.ponder()
+        >>> results[(1,)] = (3, None)
+        >>> s.takePondered([1]), stop.is_set(), s.takePondered([1])
+        ((3, None), True, None)
+        """
+        pondered = self.pondered
+        self.stopPondering()
+        return None if pondered is None else pondered.get(tuple(gamestate))
+
+
+class SessionStore():
+    """
+    >>> store = SessionStore(maxSessions=2, ttl=60)
+    >>> a = store.add(Session('greedy', 0, [0]))
+    >>> b = store.add(Session('greedy', 0, [0]))
+    >>> store.add(Session('greedy', 0, [0]))
+    Traceback (most recent call last):
+        ...
+    sessions.StoreFull: all 2 sessions are in use
+    >>> store.get(a.id) is a, store.remove(b.id) is b, store.get(b.id)
+    (True, True, None)
+    >>> r = store.report()
+    >>> r['sessions'], r['created'], r['rejected']
+    (1, 2, 1)
+    """
+
+    def __init__(self, maxSessions=MAX_SESSIONS, ttl=TTL):
+        self.maxSessions = maxSessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.rejected = 0
+        self.ponderHits = 0
+        self.ponderMisses = 0
+
+    def expire(self):
+        # least recently used first
+        now = timer()
+        for sessionId, session in list(self.sessions.items()):
+            if now - session.used < self.ttl:
+                break
+            del self.sessions[sessionId]
+            session.stopPondering()
+            self.expired += 1
+
+    def add(self, session):
+        with self.lock:
+            self.expire()
+            if len(self.sessions) >= self.maxSessions:
+                self.rejected += 1
+                raise StoreFull("all {} sessions are in use".format(
+                    self.maxSessions))
+            self.sessions[session.id] = session
+            self.created += 1
+        return session
+
+    def get(self, sessionId):
+        '''
+        The session, which counts as used now, or None when there is no
+        such session or it expired.
+        '''
+        with self.lock:
+            self.expire()
+            session = self.sessions.get(sessionId)
+            if session is not None:
+                session.used = timer()
+                self.sessions.move_to_end(sessionId)
+            return session
+
+    def remove(self, sessionId):
+        with self.lock:
+            session = self.sessions.pop(sessionId, None)
+        if session is not None:
+            session.stopPondering()
+        return session
+
+    def countPondered(self, hit):
+        with self.lock:
+            if hit:
+                self.ponderHits += 1
+            else:
+                self.ponderMisses += 1
+
+    def report(self):
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "max_sessions": self.maxSessions,
+                "ttl_sec": self.ttl,
+                "created": self.created,
+                "expired": self.expired,
+                "rejected": self.rejected,
+                "ponder_hits": self.ponderHits,
+                "ponder_misses": self.ponderMisses,
+            }
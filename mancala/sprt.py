@@ -0,0 +1,175 @@
+import math
+import random
+import game_state as s
+import profiler
+
+# Sequential probability ratio test for head to head matches. Games are
+# played in pairs from the same random opening with the players swapping
+# seats, and the pair's total score (0, 0.5, 1, 1.5 or 2) is the sample, so
+# the luck of the opening cancels out. After every pair the log likelihood
+# ratio of elo1 against elo0 is checked against the bounds set by alpha and
+# beta, and the match stops as soon as it crosses one.
+
+OPENING_PLIES = 4
+PAIR_SCORES = [0, 0.25, 0.5, 0.75, 1]
+# virtual pairs added to every outcome, so a short run of identical results
+# does not look like a certainty
+PRIOR_PAIRS = 0.5
+
+
+def expectedScore(elo):
+    """
+    >>> expectedScore(0)
+    0.5
+    >>> round(expectedScore(400), 3)
+    0.909
+    """
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def bounds(alpha, beta):
+    """
+    >>> [round(x, 3) for x in bounds(0.05, 0.05)]
+    [-2.944, 2.944]
+    """
+    return (math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha))
+
+
+def llr(pairs, elo0, elo1):
+    """
+    Log likelihood ratio of elo1 against elo0, given counts of pairs scoring
+    0, 0.5, 1, 1.5 and 2, using the normal approximation to the
+    pentanomial model.
+    >>> llr([0, 0, 0, 0, 0], 0, 10)
+    0.0
+    >>> llr([2, 5, 20, 5, 2], 0, 10) < 0 < llr([2, 5, 20, 9, 4], 0, 10)
+    True
+    """
+    n = sum(pairs)
+    if not n:
+        return 0.0
+    counts = [c + PRIOR_PAIRS for c in pairs]
+    total = sum(counts)
+    mean = sum(c * x for c, x in zip(counts, PAIR_SCORES)) / total
+    var = sum(c * (x - mean) ** 2 for c, x in zip(counts, PAIR_SCORES)) / total
+    (s0, s1) = (expectedScore(elo0), expectedScore(elo1))
+    return n * (s1 - s0) * (2 * mean - s0 - s1) / (2 * var)
+
+
+def eloEstimate(pairs):
+    """
+    >>> eloEstimate([0, 0, 1, 3, 0])
+    137.0
+    """
+    n = sum(pairs)
+    score = sum(c * x for c, x in zip(pairs, PAIR_SCORES)) / max(1, n)
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return round(-400 * math.log10(1 / score - 1), 1)
+
+
+def randomOpening(rng, plies=OPENING_PLIES):
+    """
+    Random legal moves from the start, retried if the game ends early.
+    >>> len(randomOpening(random.Random(0)))
+    4
+    """
+    while True:
+        game = s.init()
+        moves = []
+        for _ in range(plies):
+            if s.isGameOver(game):
+                break
+            move = rng.choice(s.getLegalMoves(game))
+            moves.append(move)
+            game = s.doMove(game, move)
+        if not s.isGameOver(game):
+            return moves
+
+
+def playOpening(opening, *players):
+    game = s.init()
+    for move in opening:
+        game = s.doMove(game, move)
+    while not s.isGameOver(game):
+        move = profiler.move(players[s.getCurrentPlayer(game)], game)
+        game = s.doMove(game, move)
+    return s.getWinner(game)
+
+
+def playPair(new, old, opening, seed):
+    '''
+    Score of new over two games from the same opening, first moving first
+    and then second. Both games use the same seed.
+    '''
+    score = 0
+    random.seed(seed)
+    winner = playOpening(opening, new, old)
+    score += {0: 1, -1: 0.5}.get(winner, 0)
+    random.seed(seed)
+    winner = playOpening(opening, old, new)
+    score += {1: 1, -1: 0.5}.get(winner, 0)
+    return score
+
+
+class SPRT():
+    '''
+    Test whether new is at least elo1 stronger than old (H1) or no more than
+    elo0 stronger (H0).
+    '''
+
+    def __init__(self, elo0=0, elo1=10, alpha=0.05, beta=0.05):
+        self.elo0 = elo0
+        self.elo1 = elo1
+        (self.lower, self.upper) = bounds(alpha, beta)
+        self.pairs = [0, 0, 0, 0, 0]
+
+    def add(self, pairScore):
+        self.pairs[int(pairScore * 2)] += 1
+
+    def games(self):
+        return sum(self.pairs) * 2
+
+    def llr(self):
+        return llr(self.pairs, self.elo0, self.elo1)
+
+    def decision(self):
+        """
+        >>> t = SPRT()
+        >>> t.decision()
+        >>> for _ in range(200):
+        ...     t.add(1.5)
+        ...     t.add(1)
+        >>> t.decision()
+        'H1'
+        """
+        value = self.llr()
+        if value >= self.upper:
+            return 'H1'
+        if value <= self.lower:
+            return 'H0'
+        return None
+
+    def format(self):
+        return "{} games, pairs {}, llr {} ({}, {}), elo {}".format(
+            self.games(), self.pairs, round(self.llr(), 3),
+            round(self.lower, 3), round(self.upper, 3),
+            eloEstimate(self.pairs))
+
+
+def run(new, old, test, maxGames=20000, seed=0, log=None):
+    '''
+    Play pairs until the test decides or maxGames are used. Returns the
+    decision, or None if it ran out of games.
+    '''
+    rng = random.Random(seed)
+    n = 0
+    while test.games() < maxGames:
+        opening = randomOpening(rng)
+        test.add(playPair(new, old, opening, '{}:{}'.format(seed, n)))
+        n += 1
+        if log is not None:
+            log(test.format())
+        decision = test.decision()
+        if decision is not None:
+            return decision
+    return None
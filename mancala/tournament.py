@@ -1,7 +1,13 @@
 import game_state as s
 import sys
+import random
+from timeit import default_timer as timer
 from ai_list import makeAIList
+from options import splitOptions, spawnContext
+import profiler
 from print_table import printTable
+from ratings import Ratings, RATINGS_FILE, printRatings
+from journal import Journal, moveTimes, printTimes
 import logging
 
 logger = logging.getLogger(__name__)
@@ -16,6 +22,14 @@ logger.addHandler(ch)
 results = logging.getLogger('results')
 results.setLevel(logging.INFO)
 
+PROFILE_FILE = 'data/profile.json'
+
+# players by name in this process, loaded on demand (see ai_list.AIEntry)
+players = {}
+# whether to profile moves, and the profile of every game finished so far
+profiling = False
+moveProfile = None
+
 
 def matchups(num_players, num_epochs):
     for e in range(num_epochs):
@@ -25,30 +39,212 @@ def matchups(num_players, num_epochs):
                 yield (i, j, e)
 
 
-def play_game(*players):
+def play_game(*players, times=None):
     game = s.init()
     done = False
     while not done:
         player = s.getCurrentPlayer(game)
-        move = players[player].move(game)
+        if times is None:
+            move = profiler.move(players[player], game)
+        else:
+            start = timer()
+            move = profiler.move(players[player], game)
+            times[player] += timer() - start
         game = s.doMove(game, move)
         done = s.isGameOver(game)
     return s.getWinner(game)
 
 
-def main(numEpochs="3", *exclude):
+def gameSeed(seed, epoch, name1, name2):
+    """
+    Every game gets its own seed, so a game plays out the same no matter
+    which worker runs it or in what order.
+    >>> gameSeed(0, 2, 'luck', 'greedy')
+    '0:2:luck:greedy'
+    """
+    return '{}:{}:{}:{}'.format(seed, epoch, name1, name2)
+
+
+def initPlayers(names, profile=False):
+    global players
+    global profiling
+    players = {x['name']: x for x in makeAIList(names)}
+    profiling = profile
+
+
+def play_seeded(task):
+    (i, j, e, name1, name2, seed) = task
+    # load both players before seeding, loading may use random numbers
+    (p1, p2) = (players[name1]['ai'], players[name2]['ai'])
+    random.seed(seed)
+    times = [0, 0]
+    if profiling:
+        profiler.start()
+    start = timer()
+    winner = play_game(p1, p2, times=times)
+    secs = timer() - start
+    return (i, j, e, winner, secs, times, profiler.stop())
+
+
+def open_pool(names, workers, profile=False):
+    """
+    With more than one worker, games are spread over a process pool where
+    each worker loads the AIs it needs once. Otherwise games are played
+    here and this returns None.
+    """
+    if workers <= 1:
+        initPlayers(names, profile)
+        return None
+    ctx = spawnContext()
+    return ctx.Pool(workers, initializer=initPlayers,
+                    initargs=(names, profile))
+
+
+def run_games(tasks, pool=None):
+    """
+    Play tasks and yield results as they finish.
+    """
+    if pool is None:
+        for task in tasks:
+            yield play_seeded(task)
+    else:
+        yield from pool.imap_unordered(play_seeded, list(tasks))
+
+
+def journaled(games, journal, names, seed):
+    """
+    Write each finished game to the journal, if there is one, and add up
+    move profiles.
+    """
+    for result in games:
+        (i, j, e, winner, sec, times, profile) = result
+        if profile is not None:
+            moveProfile.merge(profile)
+        if journal is not None:
+            journal.write(gameSeed(seed, e, names[i], names[j]),
+                          (names[i], names[j]), winner, times)
+        yield result
+
+
+def round_robin(numEpochs, names, pool, seed, resultList, journal=None):
+    tasks = []
+    for i, j, e in matchups(len(names), numEpochs):
+        key = gameSeed(seed, e, names[i], names[j])
+        if journal is not None and key in journal:
+            # finished in an earlier run
+            resultList[i][j][journal.records[key]['winner'] + 1] += 1
+            continue
+        tasks.append((i, j, e, names[i], names[j], key))
+    total = len(names) * len(names) * numEpochs
+    logger.info("{} of {} games to play".format(len(tasks), total))
+    start = timer()
+    games = journaled(run_games(tasks, pool), journal, names, seed)
+    for done, (i, j, e, winner, sec, times, p) in enumerate(games, 1):
+        resultList[i][j][winner + 1] += 1
+        gps = done / (timer() - start)
+        logger.debug("game {}/{}: {} vs {} winner {} in {} sec, {} g/s".format(
+            done, len(tasks), names[i], names[j], winner, round(sec, 3),
+            round(gps, 3)))
+    return len(tasks)
+
+
+def rated(maxGames, names, pool, seed, resultList, ratings, pairsPerRound,
+          journal=None):
+    """
+    Schedule games between the pairs whose order is least certain, both
+    ways round, and refit after each round until the ranking settles.
+    """
+    played = 0
+    while played < maxGames:
+        pairs = ratings.nextPairs(names, pairsPerRound)
+        if not pairs:
+            logger.info("ranking settled after {} games".format(played))
+            break
+        tasks = []
+        for (u, i, j) in pairs:
+            for (a, b) in [(i, j), (j, i)]:
+                # seeded by games already played, so later runs never
+                # replay the same game
+                n = ratings.games(names[a], names[b])
+                while journal is not None and gameSeed(
+                        seed, n, names[a], names[b]) in journal:
+                    # finished in an earlier run, and already counted
+                    n += 1
+                tasks.append((a, b, n, names[a], names[b],
+                              gameSeed(seed, n, names[a], names[b])))
+        games = journaled(run_games(tasks, pool), journal, names, seed)
+        for (i, j, e, winner, sec, times, p) in games:
+            ratings.record(names[i], names[j], winner,
+                           gameSeed(seed, e, names[i], names[j]))
+            resultList[i][j][winner + 1] += 1
+            played += 1
+        ratings.save()
+        logger.debug("{} games, least certain pair {} {} at {}".format(
+            played, names[pairs[0][1]], names[pairs[0][2]],
+            round(pairs[0][0], 3)))
+    return played
+
+
+def main(numEpochs="3", *args):
+    """
+    Play numEpochs rounds of every pair, or with --rated play up to that
+    many games, choosing pairs to settle the ranking with as few games as
+    possible. With --profile=file.json the move latency of each AI is
+    written there and shown in the table.
+    """
+    global moveProfile
+    (exclude, options) = splitOptions(args)
     numEpochs = int(numEpochs)
+    workers = int(options.get('workers', 1))
+    seed = options.get('seed', 0)
     aiList = makeAIList()
     aiList = [ x for x in aiList if x['name'] not in  exclude ]
     aiList = sorted(aiList, key=lambda x: x['name'])
+    names = [x['name'] for x in aiList]
     numPlayers = len(aiList)
     resultList = [[[0, 0, 0] for n in range(numPlayers)]
                   for m in range(numPlayers)]
-    for i, j, e in matchups(numPlayers, numEpochs):
-        # play game
-        winner = play_game(aiList[i]['ai'], aiList[j]['ai']) + 1
-        resultList[i][j][winner] += 1
-    printTable(resultList, [x['name'] for x in aiList])
+    ratings = None
+    journal = None
+    if options.get('journal'):
+        journal = Journal(options['journal'])
+    profile = options.get('profile')
+    moveProfile = profiler.MoveProfiler()
+    start = timer()
+    pool = open_pool(names, workers, bool(profile))
+    try:
+        if options.get('rated'):
+            ratings = Ratings(options.get('ratings', RATINGS_FILE))
+            if journal is not None:
+                # games the journal has which the ratings haven't counted,
+                # e.g. from a run which was stopped before it saved them
+                for key, r in journal.records.items():
+                    ratings.record(*r['players'], r['winner'], key=key)
+            total = rated(numEpochs, names, pool, seed, resultList, ratings,
+                          max(1, workers // 2), journal)
+        else:
+            total = round_robin(numEpochs, names, pool, seed, resultList,
+                                journal)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if journal is not None:
+            journal.close()
+    if profile:
+        printTable(resultList, names,
+                   (profiler.COLUMNS, moveProfile.columns(names)))
+        moveProfile.save(PROFILE_FILE if profile is True else profile)
+    else:
+        printTable(resultList, names)
+    if ratings is not None:
+        printRatings(ratings.table(names))
+    if journal is not None:
+        printTimes(moveTimes(r for r in journal.records.values()
+                             if set(r['players']) <= set(names)))
+    elapsed = timer() - start
+    print("{} games in {} sec, {} games/sec with {} workers".format(
+        total, round(elapsed, 3), round(total / max(elapsed, 1e-9), 3),
+        workers))
 
 
 if __name__ == '__main__':
@@ -5,17 +5,14 @@ import draw_game
 import game_state as s
 import logging
 from random import shuffle
-from timeit import default_timer as timer
+from prefetch import Prefetcher, readTrainingFile
 import time
 
 logger = logging.getLogger(__name__)
 ch = logging.StreamHandler(sys.stderr)
 logger.addHandler(ch)
 
-
-def trainFile(player, filename):
-    print("training {} with {}".format(player.nn.name, filename))
-    player.train(datafile=filename)
+VALIDATION_ROWS = 5000
 
 
 def oldmain(name="nn", inputfile='trainingmoves.csv'):
@@ -32,8 +29,8 @@ def oldmain(name="nn", inputfile='trainingmoves.csv'):
     print("move: {}".format(move))
 
 
-def main(name="nn", directory="training"):
-    message = "epoch {}: completed {} / {} files | remaining for epoch {}"
+def main(name="nn", directory="training", workers="2", epochs="50"):
+    message = "epoch {}: {} | remaining for epoch {}"
     ai = importlib.import_module('ai.' + name)
     player = ai.AI()
     files = glob.glob(directory + '/*.jsonl*')
@@ -41,23 +38,28 @@ def main(name="nn", directory="training"):
     # batch in training. That way we get through all the files faster.
     player.nn.epochs = 1
     player.nn.batch_size = 50000
-    for epoch in range(50):
+    # hold out one file to decide when the weights are worth saving
+    validation = []
+    if len(files) > 1:
+        validation = readTrainingFile(files.pop())[:VALIDATION_ROWS]
+    for epoch in range(int(epochs)):
+        start = time.time()
         shuffle(files)
-        total = len(files)
-        done = 0
-        start = timer()
-        for f in files:
-            trainFile(player, f)
-            done += 1
-            end = timer()
-            remaining = 0
-            if total > 0 and done > 0:
-                pctdone = done / total
-                elapsed = end - start
-                est_total_time = elapsed / pctdone
-                remaining = est_total_time - elapsed
-                timestr = time.strftime('%H:%M:%S', time.gmtime(remaining))
-            print(message.format(epoch, done, total, timestr))
+        # files are parsed and shuffled in the background while we train
+        loader = Prefetcher(files, player.nn.batch_size, workers=int(workers))
+        for batch in loader.batches():
+            player.nn.train_batch(batch)
+            loader.stats.trained(len(batch))
+            remaining = loader.stats.remaining()
+            timestr = time.strftime('%H:%M:%S', time.gmtime(remaining))
+            stats = loader.stats.format(loader.occupancy())
+            print(message.format(epoch, stats, timestr))
+        print("epoch {}: trained {} rows in {} sec".format(
+            epoch, loader.stats.rowsTrained, round(time.time() - start, 3)))
+        if validation:
+            accuracy = player.nn.validate(validation)
+            print("epoch {}: validation accuracy {}".format(epoch, accuracy))
+            player.nn.checkpoint(accuracy=accuracy)
 
 
 if __name__ == '__main__':
@@ -1,19 +1,105 @@
+import gzip
+import os
+import queue
 import random
+import sys
+import tempfile
+import threading
 import game_state as s
+import profiler
 import logging
 from logging.handlers import RotatingFileHandler
+from timeit import default_timer as timer
 logger = logging.getLogger(__name__)
 
 results = logging.getLogger('results')
 
 BASE_PERCENT = .25
+MAX_BYTES = 10000000
+BACKUP_COUNT = 100
+# rows written to disk at a time by the results writer thread
+WRITE_BATCH_ROWS = 5000
+COMPRESS_RESULTS = os.environ.get('MANCALA_COMPRESS_RESULTS', '') == '1'
 
 
-def setupLogFile(filename):
+class BufferedResultsHandler(RotatingFileHandler):
+    '''
+    Training rows are queued as they are logged and written by a background
+    thread in batches, so the game loop never waits on formatting or disk.
+    With compress the files are gzipped; prefetch.openTraining reads either.
+    MAX_BYTES counts uncompressed bytes.
+    '''
+
+    _stop = object()
+
+    def __init__(self, filename, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT,
+                 compress=False, batch_rows=WRITE_BATCH_ROWS):
+        self.compress = compress
+        self.batch_rows = batch_rows
+        self.rows = 0
+        self.batches = 0
+        self.write_time = 0
+        super().__init__(filename, maxBytes=maxBytes, backupCount=backupCount)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def _open(self):
+        if self.compress:
+            return gzip.open(self.baseFilename, 'at', compresslevel=6)
+        return super()._open()
+
+    def handle(self, record):
+        # no lock and no formatting here, the writer thread does both
+        if self.filter(record):
+            self.queue.put(record)
+
+    def _writer(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_rows:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is self._stop
+            if stop:
+                batch.pop()
+            if batch:
+                self._writeBatch(batch)
+            if stop:
+                return
+
+    def _writeBatch(self, batch):
+        start = timer()
+        text = ''.join(self.format(r) + '\n' for r in batch)
+        with self.lock:
+            self.stream.write(text)
+            if not self.compress:
+                self.stream.flush()
+            if self.maxBytes and self.stream.tell() >= self.maxBytes:
+                self.doRollover()
+        self.rows += len(batch)
+        self.batches += 1
+        self.write_time += timer() - start
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self._stop)
+            self.thread.join()
+        super().close()
+
+
+def setupLogFile(filename, buffered=True, compress=COMPRESS_RESULTS):
     global results
-    fh = RotatingFileHandler(filename, maxBytes=10000000, backupCount=100)
+    if buffered:
+        fh = BufferedResultsHandler(filename, compress=compress)
+    else:
+        fh = RotatingFileHandler(filename, maxBytes=MAX_BYTES,
+                                 backupCount=BACKUP_COUNT)
     fh.setLevel(logging.DEBUG)
     results.addHandler(fh)
+    results.setLevel(logging.INFO)
     return results
 
 
@@ -34,7 +120,7 @@ def play_one_game(players, lucky):
         if needRandomMove(len(moves)):
             move = lucky.move(game)
         else:
-            move = players[player]['ai'].move(game)
+            move = profiler.move(players[player]['ai'], game)
         if move is None:
             logger.error("null move! ", game)
         mt = [s.flipBoardCurrentPlayer(game), s.flipMove(move, player), player]
@@ -55,3 +141,40 @@ def play_one_game(players, lucky):
         p['wins'] += isWinner
         i += 1
     return (winner, trainingset)
+
+
+def benchmarkLogging(games=500):
+    '''
+    Time the self-play loop with no results file, the plain rotating file,
+    and the buffered writer with and without compression.
+    '''
+    from ai import luck, greedy
+    lucky = luck.AI()
+    players = [{'name': 'greedy', 'ai': greedy.AI(), 'wins': 0},
+               {'name': 'luck', 'ai': luck.AI(), 'wins': 0}]
+    modes = [('none', None), ('rotating file', dict(buffered=False)),
+             ('buffered', dict(buffered=True, compress=False)),
+             ('buffered gzip', dict(buffered=True, compress=True))]
+    saved = (results.handlers[:], results.level)
+    with tempfile.TemporaryDirectory() as tmp:
+        for (label, kwargs) in modes:
+            results.handlers = []
+            results.setLevel(logging.WARNING)
+            if kwargs is not None:
+                setupLogFile(os.path.join(tmp, label + '.jsonl'), **kwargs)
+            random.seed(0)
+            start = timer()
+            for _ in range(games):
+                play_one_game(players, lucky)
+            loop = timer() - start
+            for h in results.handlers:
+                h.close()
+            total = timer() - start
+            print("{:>14}: game loop {} ms/game, {} ms/game with final "
+                  "flush".format(label, round(loop * 1000 / games, 3),
+                                 round(total * 1000 / games, 3)))
+    (results.handlers, results.level) = saved
+
+
+if __name__ == '__main__':
+    benchmarkLogging(*[int(x) for x in sys.argv[1:]])
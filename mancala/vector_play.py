@@ -0,0 +1,274 @@
+import random
+import sys
+import numpy as np
+import game_state as s
+from timeit import default_timer as timer
+from ai_list import makeAIList
+from ai import luck
+from trainlib import play_one_game, BASE_PERCENT
+
+# Lockstep self-play: many games are kept in flight as rows of an (N, 15)
+# array and every row moves at once. Moves are applied with numpy, neural
+# network players choose moves for all of their boards in one forward pass,
+# and finished boards are recycled into new games. Training rows come out in
+# the same format as trainlib.play_one_game, a game at a time.
+
+MAX_PLIES = 256
+
+
+def sowingTargets():
+    """
+    For each pit, the 14 bowls stones are sown into, in order, starting
+    after that pit. game_state.doMove uses up a stone on the opponent's
+    mancala without dropping it, so that bowl stays in the cycle here and is
+    masked out by SKIP.
+    >>> t = sowingTargets()
+    >>> t[4].tolist()
+    [5, 6, 7, 8, 9, 10, 11, 12, 13, 0, 1, 2, 3, 4]
+    >>> SKIP[11].tolist().index(True)
+    8
+    """
+    targets = np.zeros((14, 14), dtype=np.int64)
+    for pit in range(14):
+        targets[pit] = (pit + 1 + np.arange(14)) % 14
+    return targets
+
+
+TARGETS = sowingTargets()
+SKIP = np.array([[t in s.getOpponentMancalas(s.getBowlOwner(pit))
+                  for t in TARGETS[pit]] for pit in range(14)])
+STEPS = np.arange(14)
+
+
+def scoreGames(boards):
+    """
+    Vectorised game_state.scoreGame, in place. Returns which games are over.
+    >>> b = np.array([[0, 0, 0, 0, 0, 0, 9, 12, 11, 10, 9, 8, 7, 0, 1]])
+    >>> scoreGames(b).tolist(), b.tolist()
+    ([True], [[0, 0, 0, 0, 0, 0, 9, 0, 0, 0, 0, 0, 0, 57, 1]])
+    """
+    row0 = boards[:, 0:6].sum(axis=1)
+    row1 = boards[:, 7:13].sum(axis=1)
+    over = (row0 == 0) | (row1 == 0)
+    boards[over, 6] += row0[over]
+    boards[over, 13] += row1[over]
+    boards[np.ix_(over, np.r_[0:6, 7:13])] = 0
+    return over
+
+
+def doMoves(boards, moves):
+    """
+    Vectorised game_state.doMove for legal moves given as bowl indexes.
+    >>> b = np.array([[1, 0, 3, 4, 5, 6, 0, 12, 11, 10, 9, 8, 7, 0, 0],
+    ...               [1, 2, 4, 4, 5, 6, 0, 12, 11, 10, 9, 8, 7, 0, 0]])
+    >>> doMoves(b, np.array([0, 2])).tolist()
+    [[0, 0, 3, 4, 5, 6, 9, 12, 11, 10, 9, 0, 7, 0, 1], \
+[1, 2, 0, 5, 6, 7, 1, 12, 11, 10, 9, 8, 7, 0, 0]]
+    """
+    b = boards.copy()
+    rows = np.arange(len(b))
+    player = b[:, 14]
+    stones = b[rows, moves]
+    b[rows, moves] = 0
+    targets = TARGETS[moves]
+    (laps, rest) = np.divmod(stones, 14)
+    counts = laps[:, None] + (STEPS < rest[:, None])
+    counts[SKIP[moves]] = 0
+    b[rows[:, None], targets] += counts
+    last = targets[rows, (stones - 1) % 14]
+    mancala = player * 7 + 6
+    free = last == mancala
+    # the last stone landed in an empty pit of the mover's own row
+    own = (last // 7 == player) & ~free & (b[rows, last] == 1)
+    opposite = np.where(own, 12 - last, 0)
+    capture = own & (b[rows, opposite] > 0)
+    c = rows[capture]
+    b[c, mancala[capture]] += b[c, opposite[capture]] + 1
+    b[c, opposite[capture]] = 0
+    b[c, last[capture]] = 0
+    b[:, 14] = np.where(free, player, 1 - player)
+    scoreGames(b)
+    return b
+
+
+def legalMask(boards):
+    """
+    (N, 6) mask of legal moves, counted from the current player's first pit.
+    >>> legalMask(np.array([[1, 0, 3, 4, 5, 6, 0, 0, 0, 9, 9, 8, 7, 0, 1]]))
+    array([[False, False,  True,  True,  True,  True]])
+    """
+    cols = boards[:, 14:15] * 7 + np.arange(6)
+    return np.take_along_axis(boards, cols, axis=1) > 0
+
+
+def flipBoards(boards):
+    """
+    Vectorised game_state.flipBoardCurrentPlayer.
+    >>> b = np.array([[1, 2, 4, 4, 5, 6, 0, 7, 8, 9, 10, 11, 12, 0, 1]])
+    >>> flipBoards(b)
+    array([[ 7,  8,  9, 10, 11, 12,  0,  1,  2,  4,  4,  5,  6,  0,  0]])
+    """
+    flipped = boards.copy()
+    p1 = boards[:, 14] == 1
+    flipped[p1, 0:7] = boards[p1, 7:14]
+    flipped[p1, 7:14] = boards[p1, 0:7]
+    flipped[:, 14] = 0
+    return flipped
+
+
+def winners(boards):
+    return np.where(boards[:, 6] > boards[:, 13], 0,
+                    np.where(boards[:, 13] > boards[:, 6], 1, -1))
+
+
+def compareWithGameState(games=20, seed=0):
+    """
+    Play random games both ways and count positions where they disagree.
+    >>> compareWithGameState()
+    0
+    """
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(games):
+        game = s.init()
+        while not s.isGameOver(game):
+            move = rng.choice(s.getLegalMoves(game))
+            expected = s.doMove(game, move)
+            got = doMoves(np.array([game]), np.array([move]))[0].tolist()
+            mismatches += int(got != expected)
+            game = expected
+    return mismatches
+
+
+def chooseMoves(ai, boards):
+    '''
+    Moves for one AI on several boards, as bowl indexes. Networks get all
+    of their boards in a single batch.
+    '''
+    states = boards.tolist()
+    nn = getattr(ai, 'nn', None)
+    if nn is not None and hasattr(nn, 'getMoves'):
+        return nn.getMoves(states)
+    return [ai.move(state) for state in states]
+
+
+class LockstepSelfPlay():
+
+    def __init__(self, aiList, numBoards=1024, seed=None):
+        self.aiList = aiList
+        self.n = numBoards
+        self.rng = np.random.RandomState(seed)
+        self.boards = np.tile(np.array(s.init()), (self.n, 1))
+        self.pairs = np.zeros((self.n, 2), dtype=np.int64)
+        self.plies = np.zeros(self.n, dtype=np.int64)
+        self.history = np.zeros((self.n, MAX_PLIES, 15), dtype=np.int64)
+        self.moves = np.zeros((self.n, MAX_PLIES), dtype=np.int64)
+        self.movers = np.zeros((self.n, MAX_PLIES), dtype=np.int64)
+        self.games = 0
+        self.positions = 0
+        self.newGames(np.arange(self.n))
+
+    def newGames(self, rows):
+        count = len(self.aiList)
+        i = self.rng.randint(count, size=len(rows))
+        # never play an AI against itself, like random_train
+        j = (i + self.rng.randint(1, max(2, count), size=len(rows))) % count
+        self.pairs[rows, 0] = i
+        self.pairs[rows, 1] = j
+        self.boards[rows] = s.init()
+        self.plies[rows] = 0
+
+    def pickMoves(self):
+        b = self.boards
+        player = b[:, 14]
+        legal = legalMask(b)
+        # random legal moves, like trainlib.needRandomMove
+        moves = np.argmax(self.rng.random_sample(legal.shape) * legal, axis=1)
+        moves = moves + player * 7
+        lucky = self.rng.random_sample(self.n) < BASE_PERCENT / (
+            self.plies + 1)
+        mover = self.pairs[np.arange(self.n), player]
+        for a in np.unique(mover[~lucky]):
+            rows = np.flatnonzero((mover == a) & ~lucky)
+            moves[rows] = chooseMoves(self.aiList[a]['ai'], b[rows])
+        return moves
+
+    def finish(self, rows):
+        rowsOut = []
+        final = self.boards[rows]
+        for r, board, winner in zip(rows, final, winners(final)):
+            plies = self.plies[r]
+            score = (int(board[6]), int(board[13]))
+            for k in range(plies):
+                p = int(self.movers[r, k])
+                rowsOut.append([self.history[r, k].tolist(),
+                                int(self.moves[r, k]),
+                                int(winner == p)] + list(score)[::1 - p * 2])
+            for k, a in enumerate(self.pairs[r]):
+                isWinner = (1 if k == winner else 0)
+                self.aiList[a]['ai'].gameOver(isWinner)
+                self.aiList[a]['wins'] += isWinner
+        self.games += len(rows)
+        return rowsOut
+
+    def step(self):
+        '''
+        Move every board once. Returns training rows of finished games.
+        '''
+        moves = self.pickMoves()
+        b = self.boards
+        rows = np.arange(self.n)
+        player = b[:, 14]
+        k = np.minimum(self.plies, MAX_PLIES - 1)
+        self.history[rows, k] = flipBoards(b)
+        self.moves[rows, k] = (moves + player * 7) % 14
+        self.movers[rows, k] = player
+        self.plies += 1
+        self.positions += self.n
+        self.boards = doMoves(b, moves)
+        done = np.flatnonzero(scoreGames(self.boards) |
+                              (self.plies >= MAX_PLIES))
+        out = self.finish(done) if len(done) else []
+        if len(done):
+            self.newGames(done)
+        return out
+
+    def run(self, games):
+        '''
+        Yield training rows in bulk until at least games have finished.
+        '''
+        while self.games < games:
+            rows = self.step()
+            if rows:
+                yield rows
+
+
+def benchmark(aiList, games, numBoards):
+    lucky = luck.AI()
+    start = timer()
+    positions = 0
+    for _ in range(games):
+        i = random.randrange(len(aiList))
+        j = (i + random.randrange(1, max(2, len(aiList)))) % len(aiList)
+        (winner, moves) = play_one_game([aiList[i], aiList[j]], lucky)
+        positions += len(moves)
+    loopRate = positions / (timer() - start)
+    engine = LockstepSelfPlay(aiList, numBoards)
+    start = timer()
+    rows = sum(len(r) for r in engine.run(games))
+    lockRate = rows / (timer() - start)
+    return (loopRate, lockRate)
+
+
+def main(games="500", boards="1024", *names):
+    aiList = makeAIList(list(names) or ['luck', 'greedy', 'nn1h128'])
+    for x in aiList:
+        x['ai']  # load before timing
+    (loopRate, lockRate) = benchmark(aiList, int(games), int(boards))
+    msg = "positions/sec: one game at a time {}, lockstep x{} boards {} ({}x)"
+    print(msg.format(int(loopRate), boards, int(lockRate),
+                     round(lockRate / max(loopRate, 1e-9), 1)))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
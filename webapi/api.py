@@ -1,12 +1,84 @@
-from flask import Flask, request
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import uuid
+from timeit import default_timer as timer
+from flask import Flask, Response, g, request
 from mancala import game_state
 from flask_json import FlaskJSON, as_json, JsonError, jsonify
-from mancala.aimove import aiMove
+from mancala.aimove import aiMoveStats, aiMoves, aiSearch, searchLimits
+from mancala.aimove import aiPonder
+from mancala.aimove import AIBusy, getPool, isSearching
+from mancala.aimove import preload as preloadAI
+from mancala.aimove import stats as aiStats, getCache
+from mancala.aimove import copyTimes, moveTimes, loadTimes
+from mancala.jobs import JobQueue, QueueFull
+from mancala.sessions import Session, SessionStore, StoreFull
+from mancala import metrics
 from mancala.game_state import isGameOver, scoreGame, getScore, getWinner
 
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+ch = logging.StreamHandler(sys.stderr)
+ch.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+logger.addHandler(ch)
+
 app = Flask(__name__)
 FlaskJSON(app)
 
+# AIs to load and warm up when the API starts, e.g.
+# MANCALA_PRELOAD=nn1h128,greedy. /ready answers 503 until they are loaded.
+PRELOAD = [x for x in os.environ.get('MANCALA_PRELOAD', '').split(',') if x]
+
+# most items in one request to /batch/move or /batch/aimove
+MAX_BATCH_ITEMS = int(os.environ.get('MANCALA_MAX_BATCH_ITEMS', 100))
+# searching ais play the items of a batch one after another, each within its
+# own budget, and the budgets of one request may add up to this many seconds
+MAX_BATCH_SEARCH_SECS = float(os.environ.get('MANCALA_MAX_BATCH_SEARCH_SECS',
+                                             6))
+
+# AI moves requested through /jobs are played by MANCALA_JOB_WORKERS threads,
+# with at most MANCALA_JOB_QUEUE of them waiting. Clients can wait up to
+# MAX_JOB_WAIT seconds in one poll of a job.
+jobs = JobQueue(int(os.environ.get('MANCALA_JOB_WORKERS', 2)),
+                int(os.environ.get('MANCALA_JOB_QUEUE', 100)))
+MAX_JOB_WAIT = 30
+# jobs wait their turn in the job queue, so a job waits this long for a free
+# instance of its AI rather than aimove.POOL_TIMEOUT
+JOB_POOL_TIMEOUT = 600
+
+# Games played through /sessions: at most MANCALA_MAX_SESSIONS of them, each
+# kept for MANCALA_SESSION_TTL seconds after its last request. While it is
+# the client's turn, the ai works out its replies on MANCALA_PONDER_WORKERS
+# threads, with spare instances only.
+sessions = SessionStore(int(os.environ.get('MANCALA_MAX_SESSIONS', 10000)),
+                        float(os.environ.get('MANCALA_SESSION_TTL', 1800)))
+ponderers = JobQueue(int(os.environ.get('MANCALA_PONDER_WORKERS', 1)),
+                     int(os.environ.get('MANCALA_PONDER_QUEUE', 100)),
+                     keepSecs=0)
+
+# search id -> stop event, for searches streaming from /aimove/stream
+searches = {}
+
+requestCount = metrics.Counter(
+    'mancala_http_requests_total', 'HTTP requests answered.',
+    ['route', 'method', 'status'])
+requestTime = metrics.Histogram(
+    'mancala_http_request_duration_seconds', 'Seconds to answer a request.',
+    ['route'])
+inFlight = metrics.Gauge(
+    'mancala_http_requests_in_flight', 'HTTP requests being answered.')
+
+# ai name -> seconds to load and warm up, or the error loading it. Written by
+# the preload thread, so read it through preloadedAIs()
+preloaded = {}
+preloadLock = threading.Lock()
+ready = threading.Event()
+
 
 def fixInputData(state):
     return [int(x) for x in state]
@@ -34,6 +106,30 @@ def checkWin(response):
     return response
 
 
+def routeName():
+    # the rule, e.g. /jobs/<jobId>, so paths don't each get their own series
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def startRequest():
+    g.started = timer()
+    inFlight.inc()
+
+
+@app.after_request
+def countRequest(response):
+    route = routeName()
+    requestCount.inc(route, request.method, str(response.status_code))
+    requestTime.observe(timer() - g.get('started', timer()), route)
+    return response
+
+
+@app.teardown_request
+def endRequest(error=None):
+    inFlight.inc(amount=-1)
+
+
 @app.errorhandler(404)
 def not_found(error=None):
     return errorMessage(404, 'Not Found: ' + request.url)
@@ -44,6 +140,36 @@ def not_allowed(error=None):
     return errorMessage(405, 'Method not allowed')
 
 
+def preload(names):
+    for name in names:
+        try:
+            result = preloadAI(name, game_state.init())
+        except Exception as e:
+            logger.exception("failed to load {}".format(name))
+            result = {"error": str(e)}
+        with preloadLock:
+            preloaded[name] = result
+        if 'error' not in result:
+            logger.info("loaded {} in {} sec, warm up move {} sec".format(
+                name, round(result['load_sec'], 3),
+                round(result['warmup_sec'], 3)))
+    ready.set()
+
+
+def preloadedAIs():
+    with preloadLock:
+        return dict(preloaded)
+
+
+def startPreload(names=PRELOAD):
+    """
+    Preload in the background, so the server can answer /ready meanwhile.
+    """
+    thread = threading.Thread(target=preload, args=(names,), daemon=True)
+    thread.start()
+    return thread
+
+
 @app.route("/")
 @as_json
 def slash():
@@ -80,23 +206,505 @@ def aimove():
     curl -X POST --data \
             '{"gamestate":[4,4,4,4,4,4,0,4,4,4,4,4,4,0,0],"ai-name":"luck"}' \
             http://localhost:5000/aimove
+
+    Searching ais take an optional budget of seconds, depth and/or nodes,
+    capped by the server, and report the depth and nodes they searched:
+
+    curl -X POST --data '{"gamestate":[4,4,4,4,4,4,0,4,4,4,4,4,4,0,0],
+            "ai-name":"_abpwm","budget":{"seconds":1,"depth":5}}' \
+            http://localhost:5000/aimove
+    """
+    (ai, state, limits) = aiMoveRequest()
+    try:
+        return aiMoveResponse(ai, state, limits=limits)
+    except AIBusy as e:
+        return errorMessage(503, str(e))
+
+
+def parseBudget(budget):
     """
+    Search limits for a request's budget, None without one.
+    """
+    if budget is None:
+        return None
+    try:
+        return searchLimits(budget)
+    except (TypeError, ValueError):
+        raise JsonError(description='Invalid budget.')
+
+
+def aiMoveRequest():
     data = request.get_json(force=True)
     try:
         state = fixInputData(data['gamestate'])
         ai = str(data['ai-name'])
     except (KeyError, TypeError, ValueError):
         raise JsonError(description='Invalid value.')
-    move = aiMove(ai, state)
+    return (ai, state, parseBudget(data.get('budget')))
+
+
+def aiMoveResponse(ai, state, timeout=None, limits=None):
+    (move, stats) = aiMoveStats(ai, state, timeout, limits)
+    return moveResponse(ai, state, move, stats, limits)
+
+
+def moveResponse(ai, state, move, stats=None, limits=None):
     resp = {
         "pre-state": state,
         "ai-name": ai,
         "move": move,
         "gamestate": game_state.doMove(state, move)
     }
+    if stats:
+        resp['depth'] = stats.get('depth')
+        resp['nodes'] = stats.get('nodes')
+    if limits is not None:
+        resp['budget'] = {"seconds": limits['timelimit'],
+                          "depth": limits['depthlimit'],
+                          "nodes": limits['nodelimit']}
     return checkWin(resp)
 
 
+def serverSentEvent(event, data):
+    return "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+
+
+@app.route("/aimove/stream")
+def streamAiMove():
+    """
+    Get the ai move like /aimove, as server-sent events. For searching ais,
+    a depth event with the best move and search stats is sent as each depth
+    of the search is finished. The done event has the /aimove response.
+    POST to /aimove/stream/<search>/stop to end the search early with the
+    best move so far.
+
+    curl -N -G --data ai-name=_abpwm \
+            --data gamestate=4,4,4,4,4,4,0,4,4,4,4,4,4,0,0 \
+            http://localhost:5000/aimove/stream
+    """
+    try:
+        state = fixInputData(request.args['gamestate'].split(','))
+        ai = str(request.args['ai-name'])
+    except (KeyError, ValueError):
+        raise JsonError(description='Invalid value.')
+    budget = {k: request.args[k] for k in ('seconds', 'depth', 'nodes')
+              if k in request.args}
+    limits = parseBudget(budget or None)
+    searchId = uuid.uuid4().hex
+    stop = threading.Event()
+    events = queue.Queue()
+
+    def onDepth(depth, move, stats):
+        events.put(('depth', dict(stats, depth=depth, move=move)))
+
+    def search():
+        try:
+            (move, stats) = aiSearch(ai, state, onDepth, stop,
+                                     limits=limits)
+            resp = moveResponse(ai, state, move, stats, limits)
+            events.put(('done', dict(resp, status=200)))
+        except AIBusy as e:
+            events.put(('error', {"status": 503, "message": str(e)}))
+        except Exception as e:
+            logger.exception("search {} failed".format(searchId))
+            events.put(('error', {"status": 500, "message": str(e)}))
+
+    def stream():
+        searches[searchId] = stop
+        threading.Thread(target=search, daemon=True).start()
+        try:
+            yield serverSentEvent('start', {"search": searchId})
+            while True:
+                (event, data) = events.get()
+                yield serverSentEvent(event, data)
+                if event != 'depth':
+                    break
+        finally:
+            # also when the client goes away
+            stop.set()
+            searches.pop(searchId, None)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+
+
+@app.route("/aimove/stream/<searchId>/stop", methods=['POST'])
+@as_json
+def stopSearch(searchId):
+    """
+    End a streaming search, which then sends its done event.
+    """
+    stop = searches.get(searchId)
+    if stop is None:
+        return errorMessage(404, 'No such search: ' + searchId)
+    stop.set()
+    return {"search": searchId}
+
+
+@app.route("/jobs/aimove", methods=['POST'])
+@as_json
+def submitAiMove():
+    """
+    Queue an ai move, with the same data as /aimove, and return the job id
+    at once. Fetch the result from /jobs/<id>.
+
+    curl -X POST --data \
+            '{"gamestate":[4,4,4,4,4,4,0,4,4,4,4,4,4,0,0],"ai-name":"luck"}' \
+            http://localhost:5000/jobs/aimove
+    """
+    (ai, state, limits) = aiMoveRequest()
+    try:
+        getPool(ai)
+    except ImportError:
+        return errorMessage(404, 'Unknown ai: ' + ai)
+    try:
+        job = jobs.submit(aiMoveResponse, ai, state, JOB_POOL_TIMEOUT,
+                          limits)
+    except QueueFull as e:
+        return errorMessage(503, str(e))
+    return job.summary(), 202
+
+
+@app.route("/jobs/<jobId>")
+@as_json
+def getJob(jobId):
+    """
+    A job's state, and its result (the /aimove response) once it is done.
+    With ?wait=seconds, answers as soon as the job is done or after that
+    long.
+
+    curl http://localhost:5000/jobs/<id>?wait=10
+    """
+    try:
+        wait = min(float(request.args.get('wait', 0)), MAX_JOB_WAIT)
+    except ValueError:
+        raise JsonError(description='Invalid value.')
+    job = jobs.wait(jobId, wait)
+    if job is None:
+        return errorMessage(404, 'No such job: ' + jobId)
+    return job.summary()
+
+
+def batchItems():
+    data = request.get_json(force=True)
+    try:
+        items = data['items']
+    except (KeyError, TypeError):
+        raise JsonError(description='Invalid value.')
+    if not isinstance(items, list):
+        raise JsonError(description='Invalid value.')
+    if len(items) > MAX_BATCH_ITEMS:
+        raise JsonError(413, description='At most {} items.'.format(
+            MAX_BATCH_ITEMS))
+    return items
+
+
+def itemError(code, message):
+    return {"status": code, "message": message}
+
+
+def itemState(item):
+    """
+    The gamestate of a batch item, if it is a board with a move to make.
+    """
+    state = fixInputData(item['gamestate'])
+    if len(state) != len(game_state.init()) or min(state) < 0:
+        raise ValueError(state)
+    if not game_state.getLegalMoves(state):
+        raise game_state.NoMoves(state)
+    return state
+
+
+def itemResult(state, move, extra=None):
+    result = checkWin({"gamestate": game_state.doMove(state, move)})
+    result.update(extra or {})
+    result['status'] = 200
+    return result
+
+
+@app.route("/batch/move", methods=['POST'])
+@as_json
+def batchMove():
+    """
+    Evaluate a list of player moves, like /move. Each result is either a
+    /move response or an error with its own status.
+
+    curl -X POST --data '{"items":[
+            {"gamestate":[4,4,4,4,4,4,0,4,4,4,4,4,4,0,0],"move":4},
+            {"gamestate":[4,4,4,4,4,4,0,4,4,4,4,4,4,0,0],"move":9}]}' \
+            http://localhost:5000/batch/move
+    """
+    results = []
+    for item in batchItems():
+        try:
+            state = itemState(item)
+            results.append(itemResult(state, int(item['move'])))
+        except (KeyError, TypeError, ValueError, game_state.NoMoves,
+                game_state.InvalidMove, game_state.InvalidIndex):
+            results.append(itemError(400, 'Invalid value.'))
+    return {"results": results}
+
+
+def searchItems(ai, group, results, secs):
+    """
+    Play a searching ai's batch items one by one, each within its budget,
+    while the budgets add up to no more than secs. Returns the seconds left.
+    """
+    for i, state, limits in group:
+        if limits is None:
+            results[i] = itemError(400, 'A budget is needed for ' + ai)
+            continue
+        if limits['timelimit'] > secs:
+            results[i] = itemError(413, 'Budgets over {} sec.'.format(
+                MAX_BATCH_SEARCH_SECS))
+            continue
+        secs -= limits['timelimit']
+        try:
+            (move, stats) = aiMoveStats(ai, state, None, limits)
+        except AIBusy as e:
+            results[i] = itemError(503, str(e))
+            continue
+        results[i] = itemResult(state, move, {
+            "pre-state": state, "ai-name": ai, "move": move,
+            "depth": stats.get('depth') if stats else None,
+            "nodes": stats.get('nodes') if stats else None})
+    return secs
+
+
+@app.route("/batch/aimove", methods=['POST'])
+@as_json
+def batchAiMove():
+    """
+    Get ai moves for a list of gamestates, like /aimove. Items for the same
+    network AI are played with one forward pass. Items for searching AIs
+    need a budget, and their budgets may add up to MAX_BATCH_SEARCH_SECS.
+
+    curl -X POST --data '{"items":[
+            {"gamestate":[4,4,4,4,4,4,0,4,4,4,4,4,4,0,0],"ai-name":"luck"},
+            {"gamestate":[4,4,4,4,4,4,0,4,4,4,4,4,4,0,1],"ai-name":"luck"}]}' \
+            http://localhost:5000/batch/aimove
+    """
+    items = batchItems()
+    results = [None] * len(items)
+    # ai name -> [(index, state, limits)]
+    byAI = {}
+    for i, item in enumerate(items):
+        try:
+            state = itemState(item)
+            ai = str(item['ai-name'])
+            budget = item.get('budget')
+            limits = None if budget is None else searchLimits(budget)
+        except (KeyError, TypeError, ValueError, game_state.NoMoves):
+            results[i] = itemError(400, 'Invalid value.')
+            continue
+        byAI.setdefault(ai, []).append((i, state, limits))
+    searchSecs = MAX_BATCH_SEARCH_SECS
+    for ai, group in byAI.items():
+        try:
+            if isSearching(ai):
+                searchSecs = searchItems(ai, group, results, searchSecs)
+                continue
+            moves = aiMoves(ai, [state for i, state, limits in group])
+        except AIBusy as e:
+            error = itemError(503, str(e))
+        except ImportError:
+            error = itemError(404, 'Unknown ai: ' + ai)
+        except Exception as e:
+            logger.exception("batch of {} failed".format(ai))
+            error = itemError(500, str(e) or type(e).__name__)
+        else:
+            for (i, state, limits), move in zip(group, moves):
+                results[i] = itemResult(state, move, {
+                    "pre-state": state, "ai-name": ai, "move": move})
+            continue
+        for i, state, limits in group:
+            if results[i] is None:
+                results[i] = dict(error)
+    return {"results": results}
+
+
+def setSessionState(session, gamestate):
+    session.gamestate = gamestate
+    result = checkWin({"gamestate": gamestate})
+    del result['gamestate']
+    session.result = result
+
+
+def sessionResponse(session, moves=None):
+    resp = {
+        "session": session.id,
+        "ai-name": session.ainame,
+        "player": session.player,
+        "gamestate": session.gamestate
+    }
+    resp.update(session.result)
+    if moves is not None:
+        resp['moves'] = moves
+    return resp
+
+
+def clientsTurn(session):
+    return (session.result['gameOver'] or
+            game_state.getCurrentPlayer(session.gamestate) == session.player)
+
+
+def playAiTurn(session, moves):
+    """
+    Play the ai's moves until it is the client's turn or the game is over,
+    using what it worked out while pondering when it can.
+    """
+    while not clientsTurn(session):
+        state = session.gamestate
+        pondering = session.pondered is not None
+        pondered = session.takePondered(state)
+        if pondering:
+            sessions.countPondered(pondered is not None)
+        if pondered is not None:
+            (move, stats) = pondered
+        else:
+            (move, stats) = aiMoveStats(session.ainame, state, None,
+                                        session.limits)
+        played = {"player": 1 - session.player, "move": move,
+                  "pondered": pondered is not None}
+        if stats:
+            played['depth'] = stats.get('depth')
+            played['nodes'] = stats.get('nodes')
+        moves.append(played)
+        setSessionState(session, game_state.doMove(state, move))
+        session.moves += 1
+
+
+def startPondering(session):
+    """
+    Have the ai work out its replies to each of the client's moves which
+    hands it the turn, until the client moves.
+    """
+    session.stopPondering()
+    if session.result['gameOver']:
+        return
+    replies = []
+    for move in game_state.getLegalMoves(session.gamestate):
+        state = game_state.doMove(session.gamestate, move)
+        if (not isGameOver(state) and
+                game_state.getCurrentPlayer(state) != session.player):
+            replies.append(state)
+    if not replies:
+        return
+    (stop, results) = session.ponder()
+    try:
+        ponderers.submit(aiPonder, session.ainame, replies, stop, results,
+                         session.limits)
+    except QueueFull:
+        session.stopPondering()
+
+
+def getSession(sessionId):
+    session = sessions.get(sessionId)
+    if session is None:
+        raise JsonError(404, description='No such session: ' + sessionId)
+    return session
+
+
+@app.route("/sessions", methods=['POST'])
+@as_json
+def newSession():
+    """
+    Start a game against an ai, kept by the server. The client plays player
+    0 (first) or 1, and the ai takes an optional budget like /aimove. The
+    response has the session id, the gamestate, and the ai's moves if it
+    moved first.
+
+    curl -X POST --data '{"ai-name":"_abpwm","player":0}' \
+            http://localhost:5000/sessions
+    """
+    data = request.get_json(force=True)
+    try:
+        ai = str(data['ai-name'])
+        player = game_state.validatePlayer(int(data.get('player', 0)))
+    except (KeyError, TypeError, ValueError, game_state.InvalidPlayer):
+        raise JsonError(description='Invalid value.')
+    limits = parseBudget(data.get('budget'))
+    try:
+        getPool(ai)
+    except ImportError:
+        return errorMessage(404, 'Unknown ai: ' + ai)
+    session = Session(ai, player, game_state.init(), limits)
+    setSessionState(session, session.gamestate)
+    try:
+        sessions.add(session)
+    except StoreFull as e:
+        return errorMessage(503, str(e))
+    moves = []
+    with session.lock:
+        try:
+            playAiTurn(session, moves)
+        except AIBusy as e:
+            sessions.remove(session.id)
+            return errorMessage(503, str(e))
+        startPondering(session)
+        return sessionResponse(session, moves), 201
+
+
+@app.route("/sessions/<sessionId>")
+@as_json
+def showSession(sessionId):
+    """
+    The session's gamestate.
+    """
+    session = getSession(sessionId)
+    with session.lock:
+        return sessionResponse(session)
+
+
+@app.route("/sessions/<sessionId>/move", methods=['POST'])
+@as_json
+def sessionMove(sessionId):
+    """
+    Play the client's move, then the ai's moves until it is the client's
+    turn again. moves lists the moves played, starting with the client's.
+
+    curl -X POST --data '{"move":4}' http://localhost:5000/sessions/<id>/move
+    """
+    data = request.get_json(force=True)
+    try:
+        move = int(data['move'])
+    except (KeyError, TypeError, ValueError):
+        raise JsonError(description='Invalid value.')
+    session = getSession(sessionId)
+    with session.lock:
+        if session.result['gameOver']:
+            return errorMessage(409, 'The game is over.')
+        if not clientsTurn(session):
+            return errorMessage(409, "It is not the client's turn.")
+        try:
+            state = game_state.doMove(session.gamestate, move)
+        except (game_state.InvalidMove, game_state.InvalidIndex):
+            raise JsonError(description='Invalid move.')
+        before = (session.gamestate, session.result, session.moves)
+        setSessionState(session, state)
+        session.moves += 1
+        moves = [{"player": session.player, "move": move}]
+        try:
+            playAiTurn(session, moves)
+        except AIBusy as e:
+            # as if the client had not moved, so they can try again
+            (session.gamestate, session.result, session.moves) = before
+            return errorMessage(503, str(e))
+        startPondering(session)
+        return sessionResponse(session, moves)
+
+
+@app.route("/sessions/<sessionId>", methods=['DELETE'])
+@as_json
+def endSession(sessionId):
+    """
+    Forget the session.
+    """
+    if sessions.remove(sessionId) is None:
+        return errorMessage(404, 'No such session: ' + sessionId)
+    return {"session": sessionId}
+
+
 @app.route("/new")
 @as_json
 def new():
@@ -106,5 +714,132 @@ def new():
     return checkWin({"gamestate": game_state.init()})
 
 
+@app.route("/ready")
+@as_json
+def readiness():
+    """
+    200 once the preloaded AIs are loaded, 503 while loading or if any
+    failed to load.
+    """
+    # ready first, so a set ready comes with every AI loaded
+    isReady = ready.is_set()
+    ais = preloadedAIs()
+    failed = [name for name, r in ais.items() if 'error' in r]
+    status = 200 if isReady and not failed else 503
+    return {"ready": status == 200, "ais": ais}, status
+
+
+@app.route("/stats")
+@as_json
+def stats():
+    """
+    Instances in use and waiting requests for each AI, batch sizes and
+    added latency for batched networks, move cache hits, the depth of and
+    wait in the job queue, and game sessions and how often pondering paid
+    off.
+    """
+    return {"ais": aiStats(), "cache": getCache().report(),
+            "jobs": jobs.report(), "sessions": sessions.report()}
+
+
+def aiMetrics():
+    lines = metrics.summary(
+        'mancala_ai_move_seconds', 'Seconds an AI took to choose a move.',
+        copyTimes(moveTimes), 'ai')
+    lines += metrics.summary(
+        'mancala_ai_load_seconds', 'Seconds constructing an AI instance took.',
+        copyTimes(loadTimes), 'ai')
+    lines += metrics.gauge(
+        'mancala_ai_preload_seconds', 'Seconds loading and warming up AIs.',
+        [({'ai': ai, 'phase': phase}, r[phase + '_sec'])
+         for ai, r in sorted(preloadedAIs().items()) if 'error' not in r
+         for phase in ('load', 'warmup')])
+    ais = sorted(aiStats().items())
+    lines += metrics.gauge(
+        'mancala_ai_instances', 'AI instances, busy or idle.',
+        [({'ai': ai, 'state': state}, n)
+         for ai, r in ais
+         for state, n in [('busy', r['pool']['busy']),
+                          ('idle', r['pool']['created'] - r['pool']['busy'])]])
+    lines += metrics.gauge(
+        'mancala_ai_waiting', 'Requests waiting for an AI instance.',
+        [({'ai': ai}, r['pool']['waiting']) for ai, r in ais])
+    batched = [(ai, r['batching']) for ai, r in ais if 'batching' in r]
+    lines += metrics.gauge(
+        'mancala_ai_batches_total', 'Forward passes run for batched moves.',
+        [({'ai': ai}, b['batches']) for ai, b in batched], 'counter')
+    lines += metrics.gauge(
+        'mancala_ai_batched_moves_total', 'Moves chosen in batches.',
+        [({'ai': ai}, b['requests']) for ai, b in batched], 'counter')
+    return lines
+
+
+def cacheMetrics():
+    cache = getCache().report()
+    lines = metrics.gauge(
+        'mancala_move_cache_hits_total', 'Moves served from the cache.',
+        [({'ai': ai}, c['hits']) for ai, c in cache['by_ai'].items()],
+        'counter')
+    lines += metrics.gauge(
+        'mancala_move_cache_misses_total', 'Cacheable moves not in the cache.',
+        [({'ai': ai}, c['misses']) for ai, c in cache['by_ai'].items()],
+        'counter')
+    lines += metrics.gauge(
+        'mancala_move_cache_entries', 'Positions in the move cache.',
+        [({}, cache['size'])])
+    lines += metrics.gauge(
+        'mancala_move_cache_evictions_total', 'Moves dropped from the cache.',
+        [({}, cache['evictions'])], 'counter')
+    return lines
+
+
+def jobMetrics():
+    report = jobs.report()
+    lines = metrics.gauge(
+        'mancala_jobs_queued', 'Jobs waiting for a worker.',
+        [({}, report['queued'])])
+    lines += metrics.gauge(
+        'mancala_jobs_running', 'Jobs being run.', [({}, report['running'])])
+    lines += metrics.gauge(
+        'mancala_jobs_total', 'Jobs finished or turned away.',
+        [({'state': state}, report[state])
+         for state in ('completed', 'failed', 'rejected')], 'counter')
+    lines += metrics.summary(
+        'mancala_job_wait_seconds', 'Seconds jobs waited for a worker.',
+        {'aimove': jobs.waitTimes()}, 'job')
+    return lines
+
+
+def sessionMetrics():
+    report = sessions.report()
+    lines = metrics.gauge(
+        'mancala_sessions', 'Games kept for /sessions.',
+        [({}, report['sessions'])])
+    lines += metrics.gauge(
+        'mancala_sessions_total', 'Sessions started, expired or turned away.',
+        [({'state': state}, report[state])
+         for state in ('created', 'expired', 'rejected')], 'counter')
+    lines += metrics.gauge(
+        'mancala_ponder_total', 'AI turns after pondering, by whether the '
+        'pondered move was ready.',
+        [({'result': 'hit'}, report['ponder_hits']),
+         ({'result': 'miss'}, report['ponder_misses'])], 'counter')
+    return lines
+
+
+@app.route("/metrics")
+def prometheusMetrics():
+    """
+    Request counts and latency, AI move and load times, pools, batching,
+    the move cache, jobs and sessions, in the Prometheus text format.
+    """
+    lines = (requestCount.lines() + requestTime.lines() + inFlight.lines() +
+             aiMetrics() + cacheMetrics() + jobMetrics() + sessionMetrics())
+    return Response('\n'.join(lines) + '\n',
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def main():
-    app.run(host='127.0.0.1')
+    startPreload()
+    # requests are served on threads, see MANCALA_POOL_SIZE in aimove.py
+    app.run(host='127.0.0.1', threaded=True)
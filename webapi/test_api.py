@@ -1,6 +1,11 @@
+import json
+import threading
+import time
 import pytest
 
 import api
+from mancala import aimove
+from mancala.sessions import SessionStore
 
 
 @pytest.fixture
@@ -91,3 +96,358 @@ def test_aimove(client):
     assert data['winner'] == 1
     assert data['gameOver'] is True
     assert data['gamestate'] == [0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 24, 0]
+
+
+def test_ready(client):
+    api.ready.clear()
+    rv = client.get('/ready')
+    assert rv.status_code == 503
+    assert rv.json['ready'] is False
+
+    api.preload(['greedy', 'nosuchai'])
+    rv = client.get('/ready')
+    assert rv.status_code == 503
+    assert 'error' in rv.json['ais']['nosuchai']
+
+    del api.preloaded['nosuchai']
+    rv = client.get('/ready')
+    assert rv.status_code == 200
+    assert rv.json['ready'] is True
+    assert rv.json['ais']['greedy']['load_sec'] >= 0
+    assert rv.json['ais']['greedy']['warmup_sec'] >= 0
+
+
+def test_aimove_concurrent():
+    pool = aimove.getPool('greedy')
+    pool.size = 2
+    gamestate = [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]
+    statuses = []
+
+    def worker():
+        client = api.app.test_client()
+        for _ in range(20):
+            rv = client.post('/aimove', json={
+                "gamestate": gamestate, "ai-name": "greedy"})
+            statuses.append((rv.status_code, rv.json['move']))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(statuses) == 160
+    assert set(statuses) == {(200, statuses[0][1])}
+    assert pool.created <= 2
+    assert pool.stats()['busy'] == 0
+
+
+def test_aimove_busy(client):
+    pool = aimove.getPool('luck')
+    players = pool.acquireAll()
+    timeout = aimove.POOL_TIMEOUT
+    try:
+        aimove.POOL_TIMEOUT = 0.01
+        rv = client.post('/aimove', json={
+            "gamestate": [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0],
+            "ai-name": "luck"})
+        assert rv.status_code == 503
+    finally:
+        aimove.POOL_TIMEOUT = timeout
+        for p in players:
+            pool.release(p)
+
+
+def test_aimove_cache(client, monkeypatch):
+    gamestate = [3, 0, 5, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 1, 0]
+    cache = aimove.getCache()
+
+    def hits(name):
+        return cache.report()['by_ai'].get(name, {'hits': 0})['hits']
+
+    before = hits('greedy')
+    moves = set()
+    for _ in range(3):
+        rv = client.post('/aimove', json={"gamestate": gamestate,
+                                          "ai-name": "greedy"})
+        moves.add(rv.json['move'])
+    assert len(moves) == 1
+    assert hits('greedy') == before + 2
+
+    # a new checkpoint invalidates the cached moves
+    monkeypatch.setattr(aimove, 'checkpointVersion', lambda name: 1)
+    aimove.versions['greedy'] = (0, 0)
+    client.post('/aimove', json={"gamestate": gamestate, "ai-name": "greedy"})
+    assert hits('greedy') == before + 2
+
+    client.post('/aimove', json={"gamestate": gamestate, "ai-name": "luck"})
+    assert 'luck' not in cache.report()['by_ai']
+
+    rv = client.get('/stats')
+    assert rv.json['cache']['hits'] >= 2
+
+
+def test_batch_move(client):
+    gamestate = [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]
+    items = [{"gamestate": gamestate, "move": 4},
+             {"gamestate": gamestate, "move": 9},
+             {"gamestate": gamestate},
+             {"gamestate": [0, 0, 0, 0, 0, 1, 0, 4, 4, 4, 4, 4, 4, 0, 0],
+              "move": 5}]
+    rv = client.post('/batch/move', json={"items": items})
+    assert rv.status_code == 200
+    results = rv.json['results']
+    assert results[0]['status'] == 200
+    assert results[0]['gamestate'] == [4, 4, 4, 4, 0, 5, 1, 5, 5, 4, 4, 4,
+                                       4, 0, 1]
+    assert results[1]['status'] == 400
+    assert results[2]['status'] == 400
+    assert results[3]['gameOver'] is True
+    assert results[3]['winner'] == 1
+
+    rv = client.post('/batch/move', json={"items": "nope"})
+    assert rv.status_code == 400
+    rv = client.post('/batch/move', json={
+        "items": [items[0]] * (api.MAX_BATCH_ITEMS + 1)})
+    assert rv.status_code == 413
+
+
+def test_batch_aimove(client):
+    gamestate = [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]
+    items = [{"gamestate": gamestate, "ai-name": "greedy"},
+             {"gamestate": gamestate[:-1] + [1], "ai-name": "luck"},
+             {"gamestate": gamestate, "ai-name": "nosuchai"},
+             {"gamestate": [0] * 15, "ai-name": "luck"},
+             {"gamestate": gamestate, "ai-name": "greedy"}]
+    rv = client.post('/batch/aimove', json={"items": items})
+    assert rv.status_code == 200
+    results = rv.json['results']
+    assert [r['status'] for r in results] == [200, 200, 404, 400, 200]
+    assert results[0]['move'] == results[4]['move']
+    assert results[0]['ai-name'] == 'greedy'
+    assert results[1]['move'] in range(7, 13)
+    assert results[1]['pre-state'] == gamestate[:-1] + [1]
+
+
+def test_batch_aimove_errors(client, tmp_path, monkeypatch):
+    import movedb
+    monkeypatch.setattr(movedb, 'movedbfile', str(tmp_path / 'moves.db'))
+    gamestate = [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]
+    # searching ais need a budget, and budgets add up to 6 seconds
+    items = [{"gamestate": gamestate, "ai-name": "_abpwm"},
+             {"gamestate": gamestate, "ai-name": "_abpwm",
+              "budget": {"seconds": 4, "depth": 1}},
+             {"gamestate": gamestate, "ai-name": "_abpwm",
+              "budget": {"seconds": 4, "depth": 1}},
+             {"gamestate": gamestate, "ai-name": "_abpwm",
+              "budget": {"seconds": 2, "depth": 1}},
+             {"gamestate": gamestate, "ai-name": "greedy"}]
+    rv = client.post('/batch/aimove', json={"items": items})
+    results = rv.json['results']
+    assert [r['status'] for r in results] == [400, 200, 413, 200, 200]
+    assert results[1]['depth'] == 1
+
+    # an ai failing fails only its own items
+    def aiMoves(ai, states):
+        if ai == 'luck':
+            raise RuntimeError('broken')
+        return [0] * len(states)
+    monkeypatch.setattr(api, 'aiMoves', aiMoves)
+    items = [{"gamestate": gamestate, "ai-name": "luck"},
+             {"gamestate": gamestate, "ai-name": "greedy"}]
+    rv = client.post('/batch/aimove', json={"items": items})
+    assert rv.status_code == 200
+    results = rv.json['results']
+    assert [r['status'] for r in results] == [500, 200]
+    assert results[0]['message'] == 'broken'
+
+
+def test_jobs(client):
+    gamestate = [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]
+    rv = client.post('/jobs/aimove', json={"gamestate": gamestate,
+                                           "ai-name": "greedy"})
+    assert rv.status_code == 202
+    job = rv.json['job']
+    assert rv.json['state'] in ('queued', 'running', 'done')
+
+    rv = client.get('/jobs/' + job + '?wait=5')
+    assert rv.status_code == 200
+    assert rv.json['state'] == 'done'
+    assert rv.json['result']['ai-name'] == 'greedy'
+    assert rv.json['result']['pre-state'] == gamestate
+    assert rv.json['result']['move'] in range(0, 6)
+    assert rv.json['wait_ms'] >= 0
+
+    rv = client.post('/jobs/aimove', json={"gamestate": gamestate,
+                                           "ai-name": "nosuchai"})
+    assert rv.status_code == 404
+
+    assert client.get('/jobs/nosuchjob').status_code == 404
+    assert client.get('/stats').json['jobs']['completed'] >= 1
+
+
+def sseEvents(body):
+    events = []
+    for chunk in body.strip().split('\n\n'):
+        (event, data) = chunk.split('\n')
+        events.append((event[len('event: '):],
+                       json.loads(data[len('data: '):])))
+    return events
+
+
+def test_aimove_stream(client):
+    rv = client.get('/aimove/stream?ai-name=greedy&'
+                    'gamestate=4,4,4,4,4,4,0,4,4,4,4,4,4,0,0')
+    assert rv.mimetype == 'text/event-stream'
+    events = sseEvents(rv.get_data(as_text=True))
+    assert [e for e, data in events] == ['start', 'done']
+    assert events[1][1]['ai-name'] == 'greedy'
+    assert events[1][1]['move'] in range(0, 6)
+
+    assert client.post('/aimove/stream/nosuch/stop').status_code == 404
+    assert client.get('/aimove/stream?ai-name=greedy').status_code == 400
+
+
+def test_aimove_stream_stop(client, tmp_path, monkeypatch):
+    import movedb
+    monkeypatch.setattr(movedb, 'movedbfile', str(tmp_path / 'moves.db'))
+    rv = client.get('/aimove/stream?ai-name=_abpwm&'
+                    'gamestate=3,0,6,5,1,7,3,5,2,0,6,5,4,1,0', buffered=False)
+    events = []
+    for chunk in rv.response:
+        (event, data) = sseEvents(chunk.decode())[0]
+        events.append((event, data))
+        if event == 'start':
+            search = data['search']
+        if event == 'depth' and data['depth'] == 2:
+            rv = client.post('/aimove/stream/' + search + '/stop')
+            assert rv.status_code == 200
+    depths = [data for e, data in events if e == 'depth']
+    # deeper ones may finish before the search sees the stop
+    assert [d['depth'] for d in depths] == list(range(1, len(depths) + 1))
+    assert len(depths) < 6
+    assert events[-1][0] == 'done'
+    assert events[-1][1]['move'] == depths[-1]['move']
+
+
+def test_aimove_budget(client, tmp_path, monkeypatch):
+    import movedb
+    monkeypatch.setattr(movedb, 'movedbfile', str(tmp_path / 'moves.db'))
+    gamestate = [3, 0, 6, 5, 1, 7, 3, 5, 2, 0, 6, 5, 4, 1, 0]
+    rv = client.post('/aimove', json={"gamestate": gamestate,
+                                      "ai-name": "_abpwm",
+                                      "budget": {"depth": 3}})
+    assert rv.status_code == 200
+    assert rv.json['depth'] == 3
+    assert rv.json['nodes'] > 0
+    assert rv.json['budget']['depth'] == 3
+    assert rv.json['budget']['seconds'] == aimove.MAX_SEARCH_SECS
+
+    rv = client.post('/aimove', json={"gamestate": gamestate,
+                                      "ai-name": "_abpwm",
+                                      "budget": {"depth": 99, "nodes": 50}})
+    assert rv.json['budget']['depth'] == aimove.MAX_SEARCH_DEPTH
+    assert rv.json['nodes'] >= 50
+    assert rv.json['depth'] < 5
+
+    for budget in [{"depth": 0}, {"moves": 3}, {"seconds": "soon"}, 5]:
+        rv = client.post('/aimove', json={"gamestate": gamestate,
+                                          "ai-name": "_abpwm",
+                                          "budget": budget})
+        assert rv.status_code == 400
+
+
+def test_aimove_budget_seconds(client, tmp_path, monkeypatch):
+    import movedb
+    monkeypatch.setattr(movedb, 'movedbfile', str(tmp_path / 'moves.db'))
+    # without the move db a search to a given depth always takes the same
+    # nodes
+    monkeypatch.setattr(movedb, 'recallState', lambda node: None)
+    monkeypatch.setattr(movedb, 'memorizeState', lambda *args: None)
+    gamestate = [3, 0, 6, 5, 1, 7, 3, 5, 2, 0, 6, 5, 4, 1, 0]
+    rv = client.post('/aimove', json={"gamestate": gamestate,
+                                      "ai-name": "_abpwm",
+                                      "budget": {"seconds": 0.2}})
+    timed = rv.json
+    # the depth reported was searched in full, not cut short by the time
+    rv = client.post('/aimove', json={"gamestate": gamestate,
+                                      "ai-name": "_abpwm",
+                                      "budget": {"depth": timed['depth']}})
+    assert rv.json['depth'] == timed['depth']
+    assert rv.json['nodes'] == timed['nodes']
+    assert rv.json['move'] == timed['move']
+
+
+def test_metrics(client):
+    gamestate = [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0, 0]
+    client.get('/new')
+    client.post('/aimove', json={"gamestate": gamestate, "ai-name": "luck"})
+    client.get('/jobs/nosuchjob')
+    rv = client.get('/metrics')
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/plain'
+    text = rv.get_data(as_text=True)
+    lines = text.splitlines()
+    assert any(x.startswith('mancala_http_requests_total{route="/new",'
+                            'method="GET",status="200"}') for x in lines)
+    assert any(x.startswith('mancala_http_requests_total{'
+                            'route="/jobs/<jobId>",method="GET",'
+                            'status="404"}') for x in lines)
+    assert any(x.startswith('mancala_http_request_duration_seconds_bucket{'
+                            'route="/aimove",le="+Inf"}') for x in lines)
+    assert any(x.startswith('mancala_ai_move_seconds_count{ai="luck"}')
+               for x in lines)
+    assert 'mancala_http_requests_in_flight 1' in lines
+    # every sample line is "name{labels} value"
+    for line in lines:
+        if not line.startswith('#'):
+            float(line.rsplit(' ', 1)[1])
+
+
+def test_sessions(client, monkeypatch):
+    monkeypatch.setattr(api, 'sessions', SessionStore(2, 60))
+    rv = client.post('/sessions', json={"ai-name": "greedy"})
+    assert rv.status_code == 201
+    session = rv.json['session']
+    assert rv.json['gamestate'] == [4, 4, 4, 4, 4, 4, 0, 4, 4, 4, 4, 4, 4, 0,
+                                    0]
+    assert rv.json['moves'] == []
+
+    # greedy works out its replies to the five moves which end the client's
+    # turn while the client thinks
+    stored = api.sessions.get(session)
+    for _ in range(500):
+        if len(stored.pondered or {}) == 5:
+            break
+        time.sleep(0.01)
+    rv = client.post('/sessions/' + session + '/move', json={"move": 0})
+    assert rv.status_code == 200
+    assert rv.json['moves'][0] == {"player": 0, "move": 0}
+    assert rv.json['moves'][1]['player'] == 1
+    assert rv.json['moves'][1]['pondered']
+    assert rv.json['gamestate'][14] == 0
+    assert client.get('/stats').json['sessions']['ponder_hits'] == 1
+
+    rv = client.get('/sessions/' + session)
+    assert rv.json['gamestate'] == stored.gamestate
+    assert 'moves' not in rv.json
+    rv = client.post('/sessions/' + session + '/move', json={"move": 7})
+    assert rv.status_code == 400
+
+    # the ai moves first when the client plays second
+    rv = client.post('/sessions', json={"ai-name": "greedy", "player": 1})
+    assert rv.json['moves'][0]['player'] == 0
+    assert rv.json['gamestate'][14] == 1
+    assert client.post('/sessions', json={
+        "ai-name": "greedy"}).status_code == 503
+    assert client.delete('/sessions/' + rv.json['session']).status_code == 200
+    assert client.get('/sessions/' + rv.json['session']).status_code == 404
+
+    # a move into the client's own store gives them another turn
+    rv = client.post('/sessions', json={"ai-name": "greedy"})
+    rv = client.post('/sessions/' + rv.json['session'] + '/move',
+                     json={"move": 2})
+    assert rv.json['moves'] == [{"player": 0, "move": 2}]
+    assert rv.json['gamestate'][14] == 0
+
+    assert client.post('/sessions', json={
+        "ai-name": "nosuchai"}).status_code == 404